@@ -36,7 +36,7 @@ from src.indexer.history_extractor import HistoryExtractor
 from src.indexer.scraper import WebScraper
 from src.indexer.content_processor import ContentProcessor
 from src.indexer.embedder import TextEmbedder
-from src.indexer.index_builder import IndexBuilder
+from src.indexer.index_builder import IndexBuilder, METADATA_FILES
 from src.database.schema import init_db
 from src.config import APP_HOST, APP_PORT, APP_DEBUG, DB_PATH, EXCLUDED_DOMAINS
 
@@ -73,15 +73,16 @@ def reset_indices():
     """Delete all search indices"""
     try:
         index_path = Path(BASE_DIR) / "models" / "history_search.index"
-        metadata_path = Path(BASE_DIR) / "models" / "history_metadata.pkl"
+        metadata_paths = [Path(BASE_DIR) / "models" / name for name in METADATA_FILES]
         
         if os.path.exists(index_path):
             os.remove(index_path)
             logger.info(f"Deleted index: {index_path}")
             
-        if os.path.exists(metadata_path):
-            os.remove(metadata_path)
-            logger.info(f"Deleted metadata: {metadata_path}")
+        for metadata_path in metadata_paths:
+            if os.path.exists(metadata_path):
+                os.remove(metadata_path)
+                logger.info(f"Deleted metadata: {metadata_path}")
             
         # Clear embeddings directory
         embeddings_dir = Path(BASE_DIR) / "models" / "embeddings"
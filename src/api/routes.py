@@ -10,11 +10,6 @@ import pandas as pd
 import hashlib
 
 from src.config import DB_PATH
-from src.indexer.history_extractor import HistoryExtractor
-from src.indexer.scraper import WebScraper
-from src.indexer.content_processor import ContentProcessor
-from src.indexer.embedder import TextEmbedder
-from src.indexer.index_builder import IndexBuilder
 from src.searcher.query_processor import QueryProcessor
 from src.searcher.retriever import HistoryRetriever
 from src.searcher.reranker import SearchReranker
@@ -23,6 +18,7 @@ from src.llm.generator import ResponseGenerator
 from src.llm.context_builder import ContextBuilder
 from src.llm.streaming import StreamingResponse
 from src.database.models import HistoryModel
+from src.services.job_service import extract_job, scrape_job, index_job
 
 logger = logging.getLogger(__name__)
 
@@ -36,12 +32,9 @@ history_model = HistoryModel()
 def extract_history():
     """Extract browsing history and update database"""
     try:
-        extractor = HistoryExtractor()
-        inserted_count = extractor.extract_history()
-        
         return jsonify({
             'status': 'success',
-            'message': f'Extracted {inserted_count} history entries'
+            'message': extract_job()
         })
         
     except Exception as e:
@@ -57,12 +50,9 @@ def scrape_pages():
     try:
         limit = request.json.get('limit', 50)
         
-        scraper = WebScraper()
-        scraped_count = scraper.scrape_unprocessed_pages(limit)
-        
         return jsonify({
             'status': 'success',
-            'message': f'Scraped {scraped_count} pages'
+            'message': scrape_job(limit)
         })
         
     except Exception as e:
@@ -76,31 +66,9 @@ def scrape_pages():
 def build_search_index():
     """Build search index from scraped content"""
     try:
-        # Process content
-        processor = ContentProcessor()
-        processed_items = processor.process_batch()
-        
-        if not processed_items:
-            return jsonify({
-                'status': 'success',
-                'message': 'No new content to index'
-            })
-            
-        # Embed the items
-        embedder = TextEmbedder()
-        # Get the embedding dimension
-        embedding_dim = embedder.get_embedding_dimension()
-        logger.info(f"Using embedding dimension: {embedding_dim}")
-        
-        embedded_items = embedder.embed_batch(processed_items)
-        
-        # Build the index
-        index_builder = IndexBuilder(embedding_dim=embedding_dim)
-        index, metadata = index_builder.build_index(embedded_items)
-        
         return jsonify({
             'status': 'success',
-            'message': f'Indexed {len(processed_items)} pages'
+            'message': index_job()
         })
         
     except Exception as e:
@@ -215,7 +183,6 @@ def chat_stream():
         # Create streaming response
         generator = ResponseGenerator()
         streaming = StreamingResponse(generator, prompt)
-        streaming.start_generation()
         
         return streaming.get_flask_response()
         
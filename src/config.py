@@ -84,12 +84,16 @@ CONTENT_DIR = BASE_DIR / config["scraping"]["content_dir"]
 
 # Add this to your config.py
 USE_SELENIUM = config.get("scraping", {}).get("use_selenium", True)
+SELENIUM_POOL_SIZE = config.get("scraping", {}).get("selenium_pool_size", 4)
+SCRAPE_STORAGE = config.get("scraping", {}).get("storage", "files")
 
 # Indexing settings
 CHUNK_SIZE = config["indexing"]["chunk_size"]
 CHUNK_OVERLAP = config["indexing"]["chunk_overlap"]
 EMBEDDING_MODEL = config["indexing"]["embedding_model"]
 EMBEDDING_DIM = config["indexing"]["embedding_dim"]
+INDEX_QUANTIZATION = config["indexing"].get("quantization", "none")
+HNSW_EF_SEARCH = config["indexing"].get("hnsw_ef_search", 64)
 
 # LLM settings
 LLM_MODEL_NAME = config["llm"]["model_name"]
@@ -100,8 +104,12 @@ LLM_TEMPERATURE = config["llm"]["temperature"]
 LLM_TOP_P = config["llm"]["top_p"]
 LORA_R = config["llm"]["lora_r"]
 LORA_ALPHA = config["llm"]["lora_alpha"]
+LLM_COMPILE_MODEL = config["llm"].get("compile_model", False)
 MAX_CONTEXT_CHUNKS = config["llm"]["max_context_chunks"]
 CACHE_RESPONSES = config["llm"]["cache_responses"]
+SEMANTIC_CACHE = config["llm"].get("semantic_cache", False)
+SEMANTIC_CACHE_THRESHOLD = config["llm"].get("semantic_cache_threshold", 0.9)
+PREFIX_CACHE_SIZE = config["llm"].get("prefix_cache_size", 0)
 
 # RAG settings
 SYSTEM_PROMPT = config["rag"]["system_prompt"]
@@ -110,6 +118,7 @@ SYSTEM_PROMPT = config["rag"]["system_prompt"]
 SEARCH_RESULTS_COUNT = config["search"]["results_count"]
 RERANK_MODEL = config["search"]["rerank_model"]
 USE_RERANKING = config["search"]["use_reranking"]
+USE_LANGCHAIN_SEARCH = config["search"].get("use_langchain", True)
 
 # Scheduler settings
 EXTRACT_INTERVAL = config["scheduler"]["extract_interval"]
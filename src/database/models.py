@@ -7,6 +7,7 @@ import sqlite3
 import json
 import hashlib
 import logging
+import threading
 from datetime import datetime
 from pathlib import Path
 
@@ -14,15 +15,28 @@ from src.config import DB_PATH
 
 logger = logging.getLogger(__name__)
 
+def query_fingerprint(query):
+    """Return a 128-bit BLAKE2b hex digest used as the cache key for a query"""
+    return hashlib.blake2b(query.encode('utf-8'), digest_size=16).hexdigest()
+
 class Database:
     """Base database connection class"""
     
+    # One open connection per thread and database file, shared by all models
+    _local = threading.local()
+    
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
         
     def get_connection(self):
-        """Get a database connection"""
-        return sqlite3.connect(self.db_path)
+        """Get this thread's database connection, opening it on first use"""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(self.db_path)
+        if conn is None:
+            conn = connections[self.db_path] = sqlite3.connect(self.db_path)
+        return conn
         
     def execute_query(self, query, params=None):
         """Execute a query and return results"""
@@ -44,10 +58,6 @@ class Database:
             if conn:
                 conn.rollback()
             raise
-            
-        finally:
-            if conn:
-                conn.close()
                 
     def execute_many(self, query, params_list):
         """Execute many queries with a list of parameters"""
@@ -64,10 +74,6 @@ class Database:
             if conn:
                 conn.rollback()
             raise
-            
-        finally:
-            if conn:
-                conn.close()
                 
     def execute_script(self, script):
         """Execute a SQL script"""
@@ -83,10 +89,6 @@ class Database:
             if conn:
                 conn.rollback()
             raise
-            
-        finally:
-            if conn:
-                conn.close()
 
 class HistoryModel(Database):
     """Enhanced model for browsing history data"""
@@ -140,10 +142,48 @@ class HistoryModel(Database):
         
         return self.execute_query(query, (history_id,))
         
+    def update_scraped_status_bulk(self, rows):
+        """Update the scraped status of many entries in one transaction
+        
+        Each row is (history_id, content_path, shard_id, shard_offset, shard_len),
+        with the shard fields None for content stored in its own file.
+        """
+        query = """
+        UPDATE history
+        SET scraped = 1, content_path = ?, shard_id = ?, shard_offset = ?, shard_len = ?
+        WHERE id = ?
+        """
+        
+        return self.execute_many(query, [(*row[1:], row[0]) for row in rows])
+        
+    def update_scrape_failed_bulk(self, history_ids):
+        """Mark many history entries as failed to scrape in one transaction"""
+        query = """
+        UPDATE history
+        SET scrape_attempted = 1, scrape_failed = 1
+        WHERE id = ?
+        """
+        
+        return self.execute_many(query, [(history_id,) for history_id in history_ids])
+        
+    def mark_duplicates_bulk(self, history_ids):
+        """Mark many history entries as skipped duplicates of another URL"""
+        return self.mark_skipped_bulk(history_ids)
+        
+    def mark_skipped_bulk(self, history_ids):
+        """Mark many history entries as deliberately not scraped, e.g. non-HTML content"""
+        query = """
+        UPDATE history
+        SET scraped = 2, scrape_skipped = 1
+        WHERE id = ?
+        """
+        
+        return self.execute_many(query, [(history_id,) for history_id in history_ids])
+        
     def get_unindexed_content(self, limit=100):
         """Get content that hasn't been indexed yet"""
         query = """
-        SELECT h.id, h.url, h.title, h.content_path
+        SELECT h.id, h.url, h.title, h.content_path, h.shard_offset, h.shard_len
         FROM history h
         WHERE h.scraped = 1 AND h.indexed = 0
         LIMIT ?
@@ -200,55 +240,21 @@ class HistoryModel(Database):
 
 
         
-    def search_by_keywords(self, patterns, limit=20):
+    def search_by_keywords(self, terms, limit=20):
         """Search for chunks by keywords with improved implementation"""
-        if not patterns:
+        if not terms:
             return []
             
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
-            # First try chunks table
-            chunks_results = []
-            for pattern in patterns:
-                query = """
-                SELECT c.id, c.content_id, c.chunk_text, c.chunk_index, c.metadata,
-                    h.id as history_id, h.url, h.title, h.domain, h.last_visit_time,
-                    h.visit_count
-                FROM chunks c
-                JOIN content ct ON c.content_id = ct.id
-                JOIN history h ON ct.history_id = h.id
-                WHERE c.chunk_text LIKE ?
-                ORDER BY h.last_visit_time DESC
-                LIMIT ?
-                """
-                
-                cursor.execute(query, (f"%{pattern}%", limit))
-                rows = cursor.fetchall()
-                
-                for row in rows:
-                    metadata = {}
-                    try:
-                        if row[4]:  # metadata column
-                            metadata = json.loads(row[4])
-                    except:
-                        pass
-                        
-                    result = {
-                        'id': row[0],
-                        'content_id': row[1],
-                        'chunk_text': row[2],
-                        'chunk_index': row[3],
-                        'metadata': metadata,
-                        'history_id': row[5],
-                        'url': row[6],
-                        'title': row[7],
-                        'domain': row[8],
-                        'last_visit_time': row[9],
-                        'visit_count': row[10] if len(row) > 10 else 1
-                    }
-                    chunks_results.append(result)
+            # First try chunks table, through the full-text index when it exists
+            try:
+                chunks_results = self._search_chunks_fts(cursor, terms, limit)
+            except sqlite3.OperationalError as e:
+                logger.debug(f"Full-text search unavailable, scanning chunks: {e}")
+                chunks_results = self._search_chunks_like(cursor, terms, limit)
             
             # If we didn't find enough in chunks, also search history titles
             if len(chunks_results) < limit:
@@ -263,8 +269,8 @@ class HistoryModel(Database):
                 LIMIT ?
                 """
                 
-                for pattern in patterns:
-                    cursor.execute(history_query, (f"%{pattern}%", f"%{pattern}%", remaining))
+                for term in terms:
+                    cursor.execute(history_query, (f"%{term}%", f"%{term}%", remaining))
                     rows = cursor.fetchall()
                     
                     for row in rows:
@@ -297,9 +303,79 @@ class HistoryModel(Database):
             logger.error(f"Error in keyword search: {e}")
             return []
             
-        finally:
-            if conn:
-                conn.close()
+    def _search_chunks_fts(self, cursor, terms, limit):
+        """Search chunk text with the FTS5 index, scoring matches by BM25"""
+        # Each term as a quoted prefix query, so FTS syntax in a term is matched literally
+        match = ' OR '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+        query = """
+        SELECT c.id, c.content_id, c.chunk_text, c.chunk_index, c.metadata,
+            h.id as history_id, h.url, h.title, h.domain, h.last_visit_time,
+            h.visit_count, bm25(chunks_fts) AS rank
+        FROM chunks_fts
+        JOIN chunks c ON c.id = chunks_fts.rowid
+        JOIN content ct ON c.content_id = ct.id
+        JOIN history h ON ct.history_id = h.id
+        WHERE chunks_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        """
+        
+        cursor.execute(query, (match, limit))
+        rows = cursor.fetchall()
+        
+        # BM25 is negative with the best match lowest; scale so the best match scores 1.0
+        best = rows[0][11] if rows else 0
+        results = []
+        for row in rows:
+            result = self._chunk_result(row)
+            result['score'] = row[11] / best if best < 0 else 1.0
+            results.append(result)
+            
+        return results
+        
+    def _search_chunks_like(self, cursor, terms, limit):
+        """Search chunk text by scanning for each term with LIKE"""
+        results = []
+        for term in terms:
+            query = """
+            SELECT c.id, c.content_id, c.chunk_text, c.chunk_index, c.metadata,
+                h.id as history_id, h.url, h.title, h.domain, h.last_visit_time,
+                h.visit_count
+            FROM chunks c
+            JOIN content ct ON c.content_id = ct.id
+            JOIN history h ON ct.history_id = h.id
+            WHERE c.chunk_text LIKE ?
+            ORDER BY h.last_visit_time DESC
+            LIMIT ?
+            """
+            
+            cursor.execute(query, (f"%{term}%", limit))
+            results.extend(self._chunk_result(row) for row in cursor.fetchall())
+            
+        return results
+        
+    def _chunk_result(self, row):
+        """Convert a chunk search row to a result dict"""
+        metadata = {}
+        try:
+            if row[4]:  # metadata column
+                metadata = json.loads(row[4])
+        except:
+            pass
+            
+        return {
+            'id': row[0],
+            'content_id': row[1],
+            'chunk_text': row[2],
+            'chunk_index': row[3],
+            'metadata': metadata,
+            'history_id': row[5],
+            'url': row[6],
+            'title': row[7],
+            'domain': row[8],
+            'last_visit_time': row[9],
+            'visit_count': row[10] if len(row) > 10 else 1
+        }
         
     def insert_content(self, history_id, content_data):
         """Insert processed content"""
@@ -364,6 +440,19 @@ class HistoryModel(Database):
         
         return self.execute_query(query, (limit,))
         
+    def get_recent_history_since(self, cutoff, limit=50):
+        """Get browsing history visited at or after a cutoff datetime, most recent first"""
+        query = """
+        SELECT id, url, title, visit_count, last_visit_time, domain
+        FROM history
+        WHERE last_visit_time >= ?
+        ORDER BY last_visit_time DESC
+        LIMIT ?
+        """
+        
+        # Stored timestamps use SQLite's 'YYYY-MM-DD HH:MM:SS' format, so they compare as strings
+        return self.execute_query(query, (cutoff.isoformat(sep=' ', timespec='seconds'), limit))
+        
     def get_domain_stats(self, limit=10):
         """Get statistics about visited domains"""
         query = """
@@ -423,7 +512,7 @@ class LLMCacheModel(Database):
     def cache_response(self, query, response):
         """Cache an LLM response"""
         # Create hash of the query for faster lookups
-        query_hash = hashlib.md5(query.encode()).hexdigest()
+        query_hash = query_fingerprint(query)
         
         insert_query = """
         INSERT OR REPLACE INTO llm_cache (query_hash, query, response)
@@ -432,10 +521,24 @@ class LLMCacheModel(Database):
         
         self.execute_query(insert_query, (query_hash, query, response))
         
+    def cache_response_bulk(self, rows):
+        """Cache many (query, response) pairs in one transaction"""
+        insert_query = """
+        INSERT OR REPLACE INTO llm_cache (query_hash, query, response)
+        VALUES (?, ?, ?)
+        """
+        
+        return self.execute_many(
+            insert_query,
+            [(query_fingerprint(query), query, response) for query, response in rows]
+        )
+        
     def get_cached_response(self, query):
         """Get a cached response if available"""
-        query_hash = hashlib.md5(query.encode()).hexdigest()
+        return self.get_cached_response_by_hash(query_fingerprint(query))
         
+    def get_cached_response_by_hash(self, query_hash):
+        """Get a cached response by its query fingerprint if available"""
         select_query = """
         SELECT response FROM llm_cache
         WHERE query_hash = ?
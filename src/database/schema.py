@@ -82,6 +82,9 @@ CREATE TABLE IF NOT EXISTS history (
     scrape_attempted INTEGER DEFAULT 0,
     scrape_failed INTEGER DEFAULT 0,
     scrape_skipped INTEGER DEFAULT 0,
+    shard_id INTEGER,
+    shard_offset INTEGER,
+    shard_len INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -136,8 +139,66 @@ CREATE INDEX IF NOT EXISTS idx_query_hash ON search_cache(query_hash);
 CREATE INDEX IF NOT EXISTS idx_llm_query_hash ON llm_cache(query_hash);
 """
 
+# Full-text index over chunk text for keyword search, kept in sync with the chunks
+# table by triggers. Created separately since SQLite may be built without FTS5.
+CREATE_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    chunk_text,
+    content='chunks',
+    content_rowid='id',
+    tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text) VALUES ('delete', old.id, old.chunk_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF chunk_text ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text) VALUES ('delete', old.id, old.chunk_text);
+    INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+END;
+"""
+
+# Columns added to existing tables after their first release
+ADDED_COLUMNS = {
+    "history": [
+        ("shard_id", "INTEGER"),
+        ("shard_offset", "INTEGER"),
+        ("shard_len", "INTEGER"),
+    ],
+}
 
 
+
+def _add_missing_columns(cursor):
+    """Add columns introduced after a database was created"""
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                logger.info(f"Added column {table}.{name}")
+
+def _create_fts_index(cursor):
+    """Create the chunk full-text index, indexing existing chunks the first time"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chunks_fts'"
+    ).fetchone()
+    
+    try:
+        cursor.executescript(CREATE_FTS_SQL)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"SQLite FTS5 not available, keyword search will scan chunks: {e}")
+        return
+        
+    if not exists:
+        cursor.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        logger.info("Built full-text index for existing chunks")
+
 def init_db(db_path):
     """Initialize the database with the required schema"""
     try:
@@ -147,6 +208,8 @@ def init_db(db_path):
         
         # Execute schema creation
         cursor.executescript(CREATE_TABLES_SQL)
+        _add_missing_columns(cursor)
+        _create_fts_index(cursor)
         
         # Commit changes
         conn.commit()
@@ -13,6 +13,7 @@ from bs4 import BeautifulSoup
 
 from src.config import CHUNK_SIZE, CHUNK_OVERLAP
 from src.database.models import HistoryModel
+from src.utils.file_utils import read_shard_record
 
 logger = logging.getLogger(__name__)
 
@@ -24,12 +25,15 @@ class ContentProcessor:
         self.chunk_overlap = CHUNK_OVERLAP
         self.history_model = HistoryModel()
         
-    def process_content(self, history_id, url, content_path):
+    def process_content(self, history_id, url, content_path, shard_offset=None, shard_len=None):
         """Process content from a web page with improved chunking"""
         try:
-            # Read the content file
-            with open(content_path, 'r', encoding='utf-8', errors='ignore') as f:
-                raw_text = f.read()
+            # Read the content from its shard record or its own file
+            if shard_offset is not None:
+                raw_text = read_shard_record(content_path, shard_offset, shard_len).decode('utf-8', errors='ignore')
+            else:
+                with open(content_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    raw_text = f.read()
                 
             # Extract structured data
             processed_data = self._extract_structured_data(raw_text, url)
@@ -99,14 +103,14 @@ class ContentProcessor:
         
         processed_items = []
         
-        for history_id, url, title, content_path in unindexed_content:
+        for history_id, url, title, content_path, shard_offset, shard_len in unindexed_content:
             # Skip if content path doesn't exist
             if not content_path or not os.path.exists(content_path):
                 logger.warning(f"Content path not found for {url}: {content_path}")
                 continue
                 
             # Process the content
-            processed = self.process_content(history_id, url, content_path)
+            processed = self.process_content(history_id, url, content_path, shard_offset, shard_len)
             
             if processed:
                 processed_items.append(processed)
@@ -5,6 +5,7 @@ import os
 import numpy as np
 import pickle
 import logging
+import threading
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 
@@ -12,6 +13,9 @@ from src.config import EMBEDDING_MODEL, EMBEDDING_DIM, BASE_DIR
 
 logger = logging.getLogger(__name__)
 
+# Name the LangChain vector store is saved under; save_local writes <name>.faiss and <name>.pkl
+VECTOR_STORE_NAME = "faiss_index"
+
 class TextEmbedder:
     """Generate embeddings for text content with LangChain integration"""
     
@@ -20,6 +24,8 @@ class TextEmbedder:
         self.embedding_dim = EMBEDDING_DIM
         self.embeddings_dir = Path(BASE_DIR) / "models" / "embeddings"
         self.vector_store_path = Path(BASE_DIR) / "models" / "vectorstore"
+        self.vector_store_mtimes = None
+        self.vector_store_lock = threading.Lock()
         
         # Create directories if they don't exist
         os.makedirs(self.embeddings_dir, exist_ok=True)
@@ -51,7 +57,6 @@ class TextEmbedder:
         try:
             # Import LangChain components
             from langchain.embeddings import HuggingFaceEmbeddings
-            from langchain.vectorstores import FAISS
             from langchain.text_splitter import RecursiveCharacterTextSplitter
             from langchain.schema import Document
             
@@ -61,17 +66,7 @@ class TextEmbedder:
                 model_kwargs={'device': 'cpu'}
             )
             
-            # Try to load existing vector store
-            try:
-                self.vector_store = FAISS.load_local(
-                    str(self.vector_store_path), 
-                    self.lc_embeddings, 
-                    "faiss_index"
-                )
-                logger.info("Loaded existing LangChain vector store")
-            except Exception as e:
-                logger.info(f"Creating new LangChain vector store: {e}")
-                self.vector_store = FAISS.from_texts(["initialization"], self.lc_embeddings)
+            self._load_vector_store()
                 
             logger.info("LangChain components initialized successfully")
             return True
@@ -83,6 +78,39 @@ class TextEmbedder:
             logger.error(f"Error setting up LangChain: {e}")
             return False
         
+    def _vector_store_mtimes(self):
+        """Modification times of the saved vector store files, None for missing ones"""
+        paths = [self.vector_store_path / f"{VECTOR_STORE_NAME}{suffix}" for suffix in ('.faiss', '.pkl')]
+        return tuple(path.stat().st_mtime_ns if path.exists() else None for path in paths)
+        
+    def _load_vector_store(self):
+        """Load the saved LangChain vector store, or create a new one"""
+        from langchain.vectorstores import FAISS
+        
+        # Taken before loading, so a save that lands mid-load triggers another reload
+        self.vector_store_mtimes = self._vector_store_mtimes()
+        try:
+            self.vector_store = FAISS.load_local(
+                str(self.vector_store_path), 
+                self.lc_embeddings, 
+                VECTOR_STORE_NAME
+            )
+            logger.info("Loaded existing LangChain vector store")
+        except Exception as e:
+            logger.info(f"Creating new LangChain vector store: {e}")
+            self.vector_store = FAISS.from_texts(["initialization"], self.lc_embeddings)
+            
+    def reload_vector_store_if_changed(self):
+        """Reload the vector store if it has been saved since it was loaded, e.g. by
+        an index job, so long-lived embedders search the current documents"""
+        if not self.use_langchain:
+            return
+            
+        with self.vector_store_lock:
+            if self._vector_store_mtimes() != self.vector_store_mtimes:
+                logger.info("LangChain vector store changed on disk, reloading")
+                self._load_vector_store()
+        
     def embed_text(self, text):
         """Embed a single text string"""
         if not text or not isinstance(text, str):
@@ -222,7 +250,9 @@ class TextEmbedder:
                 self.vector_store.add_documents(documents)
                 
                 # Save vector store
-                self.vector_store.save_local(str(self.vector_store_path), "faiss_index")
+                with self.vector_store_lock:
+                    self.vector_store.save_local(str(self.vector_store_path), VECTOR_STORE_NAME)
+                    self.vector_store_mtimes = self._vector_store_mtimes()
                 logger.info(f"Updated LangChain vector store with {len(documents)} documents")
         
         except Exception as e:
@@ -145,7 +145,6 @@ import sqlite3
 import logging
 import time               # 🔹 NEW
 import pandas as pd
-from urllib.parse import urlparse
 from pathlib import Path
 
 from src.config import HISTORY_DB_PATH, LAST_TIMESTAMP_FILE, EXCLUDED_DOMAINS
@@ -153,6 +152,20 @@ from src.database.models import HistoryModel
 
 logger = logging.getLogger(__name__)
 
+# Authority part of a URL (same as urlparse().netloc)
+DOMAIN_PATTERN = r"^[A-Za-z][A-Za-z0-9+.-]*://([^/?#]*)"
+
+# Columns inserted into the history table, in insert order
+HISTORY_COLUMNS = [
+    "id",
+    "url",
+    "title",
+    "visit_count",
+    "typed_count",
+    "last_visit_time",                             # human‑readable
+    "domain",
+]
+
 
 class HistoryExtractor:
     """Extract browsing history from Chrome and save to the application database"""
@@ -162,6 +175,7 @@ class HistoryExtractor:
         self.last_timestamp_file = LAST_TIMESTAMP_FILE
         self.excluded_domains = EXCLUDED_DOMAINS
         self.history_model = HistoryModel()
+        self._conn = None
 
     # ────────────────────────────────────────────────────────────────────────
     def extract_history(self):
@@ -175,10 +189,9 @@ class HistoryExtractor:
         # -------------------------------------------------------------------
         # (rest of method unchanged)
         # -------------------------------------------------------------------
-        temp_db = f"{self.history_db_path}_temp"
+        temp_db = None
         try:
-            os.system(f"cp '{self.history_db_path}' '{temp_db}'")
-            conn = sqlite3.connect(temp_db)
+            conn, temp_db = self._open_history_db()
 
             query = """
                 SELECT id,
@@ -203,26 +216,17 @@ class HistoryExtractor:
 
             df = pd.read_sql_query(query, conn)
             logger.info(f"Found {len(df)} history entries after excluding domains")
-            conn.close()
+            if temp_db:
+                conn.close()
 
             if df.empty:
                 logger.info("No new history entries found")
                 return 0
 
-            df["domain"] = df["url"].apply(self._extract_domain)
-
-            history_entries = [
-                (
-                    row["id"],
-                    row["url"],
-                    row["title"],
-                    row["visit_count"],
-                    row["typed_count"],
-                    row["last_visit_time"],        # human‑readable
-                    row["domain"],
-                )
-                for _, row in df.iterrows()
-            ]
+            # Domain = URL authority, extracted for the whole column at once
+            df["domain"] = df["url"].str.extract(DOMAIN_PATTERN, expand=False).fillna("")
+
+            history_entries = df[HISTORY_COLUMNS].to_records(index=False).tolist()
 
             inserted_count = self.history_model.insert_history(history_entries)
             logger.info(f"Inserted {inserted_count} new history entries")
@@ -238,18 +242,38 @@ class HistoryExtractor:
             raise
 
         finally:
-            if os.path.exists(temp_db):
+            if temp_db and os.path.exists(temp_db):
                 os.remove(temp_db)
 
     # ────────────────────────────────────────────────────────────────────────
     # Helpers
     # ────────────────────────────────────────────────────────────────────────
-    def _extract_domain(self, url):
-        """Extract domain from URL"""
-        try:
-            return urlparse(url).netloc
-        except Exception:
-            return ""
+    def _open_history_db(self):
+        """
+        Open Chrome's history database read-only, copying it only when Chrome
+        holds the lock. Returns the connection and the temporary copy path
+        (None when the database was opened directly).
+        """
+        # Autocommit mode: reads run without implicit transaction handling
+        if self._conn is None:
+            try:
+                uri = f"{Path(self.history_db_path).resolve().as_uri()}?mode=ro"
+                self._conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+            except sqlite3.OperationalError as e:
+                logger.info(f"Could not open history database directly: {e}")
+
+        if self._conn is not None:
+            try:
+                self._conn.execute("SELECT 1 FROM urls LIMIT 1")
+                return self._conn, None
+            except sqlite3.OperationalError as e:
+                logger.info(f"History database is locked ({e}), reading from a copy")
+                self._conn.close()
+                self._conn = None
+
+        temp_db = f"{self.history_db_path}_temp"
+        os.system(f"cp '{self.history_db_path}' '{temp_db}'")
+        return sqlite3.connect(temp_db, isolation_level=None), temp_db
 
     def _get_last_timestamp(self):
         """
@@ -8,13 +8,64 @@ import numpy as np
 import faiss
 import pickle
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from src.config import EMBEDDING_DIM, BASE_DIR
+from src.config import EMBEDDING_DIM, INDEX_QUANTIZATION, BASE_DIR
+from src.utils.time_utils import VISIT_MICROSECONDS_KEY, visit_microseconds
 
 logger = logging.getLogger(__name__)
 
+# Try to import pyarrow - metadata falls back to pickle without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    logger.warning("PyArrow not available, metadata will be stored as pickle. Install with 'pip install pyarrow'")
+    PYARROW_AVAILABLE = False
+
+# Try to import zstandard - pickled metadata is left uncompressed without it
+try:
+    import zstandard as zstd
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Index type thresholds (number of vectors)
+FLAT_INDEX_MAX_ITEMS = 10_000
+HNSW_INDEX_MAX_ITEMS = 1_000_000
+
+# HNSW / IVFPQ parameters
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+IVF_NLIST = 4096
+PQ_M = 16
+PQ_NBITS = 8
+
+# Worker threads used to assemble the index buffer and metadata
+BUILD_WORKERS = min(8, os.cpu_count() or 1)
+
+# Metadata columns stored for each indexed chunk
+METADATA_COLUMNS = [
+    'history_id', 'content_id', 'url', 'domain', 'title',
+    'chunk_id', 'chunk_text', 'last_visit_time', VISIT_MICROSECONDS_KEY
+]
+EXTRA_COLUMN = 'extra_json'
+
+# Metadata files, in the order the retriever prefers them
+PARQUET_METADATA_FILE = 'history_metadata.parquet'
+ZSTD_METADATA_FILE = 'history_metadata.pkl.zst'
+PICKLE_METADATA_FILE = 'history_metadata.pkl'
+METADATA_FILES = [PARQUET_METADATA_FILE, ZSTD_METADATA_FILE, PICKLE_METADATA_FILE]
+
+# Scalar quantizer types and their bits per dimension
+QUANTIZER_TYPES = {
+    'fp16': (faiss.ScalarQuantizer.QT_fp16, 16),
+    'sq8': (faiss.ScalarQuantizer.QT_8bit, 8),
+}
+
 class IndexBuilder:
     """Build a FAISS index from embedded chunks with improved metadata handling"""
     
@@ -22,6 +73,7 @@ class IndexBuilder:
         self.index_dir = Path(BASE_DIR) / "models"
         # Allow overriding the embedding dimension from constructor
         self.embedding_dim = embedding_dim if embedding_dim is not None else EMBEDDING_DIM
+        self.quantization = INDEX_QUANTIZATION if INDEX_QUANTIZATION in QUANTIZER_TYPES else 'none'
         
         # Create directory if it doesn't exist
         os.makedirs(self.index_dir, exist_ok=True)
@@ -34,101 +86,224 @@ class IndexBuilder:
         if embedded_items and 'embeddings' in embedded_items[0] and len(embedded_items[0]['embeddings']) > 0:
             actual_dim = embedded_items[0]['embeddings'][0].shape[0]
             if actual_dim != self.embedding_dim:
-                logger.info(f"Adjusting embedding dimension from {self.embedding_dim} to {actual_dim} based on actual data")
+                logger.info("Adjusting embedding dimension from %d to %d based on actual data", self.embedding_dim, actual_dim)
                 self.embedding_dim = actual_dim
         
-        # Initialize index - use L2 distance
-        index = faiss.IndexFlatL2(self.embedding_dim)
-        
-        # Prepare data structures
-        all_embeddings = []
-        all_metadata = []
-        
-        # Process all items
+        # First pass: find the valid embeddings of each item and its offset in the buffer
+        tasks = []
+        total = 0
+        skipped_items = 0
+        skipped_chunks = 0
         for item in embedded_items:
             # Skip if embeddings are missing
             if 'embeddings' not in item or not isinstance(item['embeddings'], np.ndarray) or item['embeddings'].size == 0:
-                logger.warning(f"No valid embeddings for {item.get('url', 'unknown URL')}")
+                skipped_items += 1
                 continue
                 
-            for i, embedding in enumerate(item['embeddings']):
-                # Skip invalid embeddings
-                if not isinstance(embedding, np.ndarray) or embedding.size == 0:
-                    continue
-                    
-                all_embeddings.append(embedding)
-                
-                # Get metadata from the item
-                chunk_metadata = item['metadata'][i] if i < len(item['metadata']) else {}
+            # Skip invalid embeddings
+            valid_ids = [
+                i for i, embedding in enumerate(item['embeddings'])
+                if isinstance(embedding, np.ndarray) and embedding.size > 0
+            ]
+            skipped_chunks += len(item['embeddings']) - len(valid_ids)
+            if valid_ids:
+                tasks.append((item, valid_ids, total))
+                total += len(valid_ids)
                 
-                # Create metadata for this embedding
-                metadata = {
-                    'history_id': item.get('history_id', 0),
-                    'content_id': item.get('content_id', 0),
-                    'url': item.get('url', ''),
-                    'domain': item.get('domain', ''),
-                    'title': item.get('title', ''),
-                    'chunk_id': i,
-                    'chunk_text': item['chunks'][i] if i < len(item['chunks']) else '',
-                    'last_visit_time': chunk_metadata.get('last_visit_time', datetime.now().isoformat())
-                }
-                
-                # Add additional metadata from the chunk
-                if chunk_metadata:
-                    for key, value in chunk_metadata.items():
-                        if key not in metadata:
-                            metadata[key] = value
-                
-                all_metadata.append(metadata)
-                
-        # Convert to numpy array
-        if not all_embeddings:
+        if skipped_items or skipped_chunks:
+            logger.warning("Skipped %d items and %d chunks with invalid embeddings", skipped_items, skipped_chunks)
+            
+        if not total:
             logger.warning("No embeddings to index")
             return None, []
             
+        # Second pass: copy embeddings into a preallocated buffer and build
+        # metadata columns, one item per worker
+        embeddings_array = np.empty((total, self.embedding_dim), dtype='float32')
+        default_visit_time = datetime.now().isoformat()
+        
         try:
-            # Stack the embeddings - make sure they're all the same shape
-            embeddings_array = np.stack(all_embeddings).astype('float32')
-            
-            # Verify dimensions
-            if embeddings_array.shape[1] != self.embedding_dim:
-                logger.warning(f"Expected embedding dimension {self.embedding_dim}, got {embeddings_array.shape[1]}")
-                
-                # Update the dimension to match the actual embeddings
-                self.embedding_dim = embeddings_array.shape[1]
-                
-                # Reinitialize the index with the correct dimension
-                index = faiss.IndexFlatL2(self.embedding_dim)
-                logger.info(f"Recreated index with correct dimension: {self.embedding_dim}")
-                
-        except Exception as e:
+            with ThreadPoolExecutor(max_workers=min(BUILD_WORKERS, len(tasks))) as executor:
+                item_columns = list(executor.map(
+                    lambda task: self._collect_item(*task, embeddings_array, default_visit_time),
+                    tasks
+                ))
+        except ValueError as e:
             logger.error(f"Error processing embeddings: {e}")
             return None, []
+            
+        # Concatenate the per-item columns in item order
+        columns = {name: [] for name in METADATA_COLUMNS + [EXTRA_COLUMN]}
+        for local_columns in item_columns:
+            for name, values in local_columns.items():
+                columns[name].extend(values)
+        
+        # Normalize once so inner product ranks the same as cosine/L2
+        faiss.normalize_L2(embeddings_array)
         
-        # Add to index
+        # Create an index suited to the collection size and add the vectors
+        index, index_type = self._create_index(embeddings_array)
+        if not index.is_trained:
+            index.train(embeddings_array)
         index.add(embeddings_array)
-        logger.info(f"Added {len(all_embeddings)} embeddings to index")
+        logger.info(f"Added {total} embeddings to {index_type} index")
         
         # Save the index
         index_path = self.index_dir / "history_search.index"
-        metadata_path = self.index_dir / "history_metadata.pkl"
         
         faiss.write_index(index, str(index_path))
         logger.info(f"Saved index to {index_path}")
         
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(all_metadata, f)
+        metadata_path = self._save_metadata(columns)
         logger.info(f"Saved metadata to {metadata_path}")
         
         # Save index info
         index_info = {
-            'num_items': len(all_metadata),
+            'num_items': total,
             'embedding_dim': self.embedding_dim,
+            'index_type': index_type,
+            'metric': 'ip',
+            'quantization': 'pq' if index_type == 'ivfpq' else self.quantization,
+            'bits_per_dim': self._bits_per_dim(index_type),
             'created_at': str(datetime.now())
         }
         
         with open(self.index_dir / "index_info.json", 'w') as f:
-            json.dump(index_info, f)
+            f.write(json.dumps(index_info))
         logger.info(f"Saved index info")
         
-        return index, all_metadata
\ No newline at end of file
+        return index, columns
+
+    @classmethod
+    def load_mmap(cls, index_path, index_type=None):
+        """Load a saved index memory-mapped so vectors are paged in on demand
+
+        history_search.index is mmap-safe for flat and IVF indexes. HNSW
+        graphs, and builds of FAISS without mmap support for the index type,
+        are read fully into memory instead.
+        """
+        if index_type != 'hnsw':
+            try:
+                return faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.info(f"Memory-mapped load not supported, reading index into memory: {e}")
+                
+        return faiss.read_index(str(index_path))
+
+    def _collect_item(self, item, valid_ids, offset, embeddings_array, default_visit_time):
+        """Copy an item's embeddings into the shared buffer and return its metadata columns"""
+        embeddings_array[offset:offset + len(valid_ids)] = item['embeddings'][valid_ids]
+        
+        history_id = item.get('history_id', 0)
+        content_id = item.get('content_id', 0)
+        url = item.get('url', '')
+        domain = item.get('domain', '')
+        title = item.get('title', '')
+        chunks = item['chunks']
+        item_metadata = item['metadata']
+        
+        columns = {name: [] for name in METADATA_COLUMNS + [EXTRA_COLUMN]}
+        for i in valid_ids:
+            # Get metadata from the item
+            chunk_metadata = item_metadata[i] if i < len(item_metadata) else {}
+            
+            # Append this embedding's metadata to each column
+            columns['history_id'].append(history_id)
+            columns['content_id'].append(content_id)
+            columns['url'].append(url)
+            columns['domain'].append(domain)
+            columns['title'].append(title)
+            columns['chunk_id'].append(i)
+            columns['chunk_text'].append(chunks[i] if i < len(chunks) else '')
+            last_visit_time = chunk_metadata.get('last_visit_time', default_visit_time)
+            columns['last_visit_time'].append(last_visit_time)
+            # Parsed once here so searches don't re-parse it for every result
+            columns[VISIT_MICROSECONDS_KEY].append(visit_microseconds(last_visit_time))
+            
+            # Keep additional chunk metadata as JSON
+            extra = {k: v for k, v in chunk_metadata.items() if k not in columns}
+            columns[EXTRA_COLUMN].append(json.dumps(extra) if extra else None)
+            
+        return columns
+
+    def _save_metadata(self, columns):
+        """Save chunk metadata columns as Parquet, falling back to pickle"""
+        metadata_path = None
+        if PYARROW_AVAILABLE:
+            try:
+                metadata_path = self.index_dir / PARQUET_METADATA_FILE
+                pq.write_table(pa.table(columns), str(metadata_path), compression='zstd')
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                logger.warning(f"Could not write Parquet metadata, falling back to pickle: {e}")
+                metadata_path = None
+                
+        if metadata_path is None:
+            data = pickle.dumps(self._metadata_rows(columns), protocol=pickle.HIGHEST_PROTOCOL)
+            if ZSTD_AVAILABLE:
+                metadata_path = self.index_dir / ZSTD_METADATA_FILE
+                data = zstd.ZstdCompressor(level=3, threads=-1).compress(data)
+            else:
+                metadata_path = self.index_dir / PICKLE_METADATA_FILE
+            
+            # One large write instead of many small ones from pickle.dump
+            with open(metadata_path, 'wb') as f:
+                f.write(data)
+            
+        # Remove metadata left over from a build in another format
+        for name in METADATA_FILES:
+            stale_path = self.index_dir / name
+            if stale_path != metadata_path and stale_path.exists():
+                stale_path.unlink()
+            
+        return metadata_path
+
+    def _metadata_rows(self, columns):
+        """Convert metadata columns to the list of dicts used by the pickle format"""
+        rows = []
+        for values in zip(*(columns[name] for name in METADATA_COLUMNS), columns[EXTRA_COLUMN]):
+            row = dict(zip(METADATA_COLUMNS, values))
+            if values[-1]:
+                row.update(json.loads(values[-1]))
+            rows.append(row)
+        return rows
+
+    def _create_index(self, embeddings_array):
+        """Create a FAISS index sized to the number of vectors
+
+        Small collections use an exact flat index, medium ones HNSW and very
+        large ones IVFPQ, trading a little accuracy for sublinear search.
+        All index types use inner product on the normalized embeddings, and
+        flat/HNSW vectors are stored scalar-quantized when configured.
+        """
+        total = embeddings_array.shape[0]
+        qtype = QUANTIZER_TYPES.get(self.quantization, (None, 32))[0]
+        
+        if total < FLAT_INDEX_MAX_ITEMS:
+            if qtype is not None:
+                index = faiss.IndexScalarQuantizer(self.embedding_dim, qtype, faiss.METRIC_INNER_PRODUCT)
+                return index, 'flat'
+            return faiss.IndexFlatIP(self.embedding_dim), 'flat'
+            
+        if total < HNSW_INDEX_MAX_ITEMS or self.embedding_dim % PQ_M != 0:
+            if qtype is not None:
+                index = faiss.IndexHNSWSQ(self.embedding_dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWFlat(self.embedding_dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            return index, 'hnsw'
+            
+        quantizer = faiss.IndexFlatIP(self.embedding_dim)
+        index = faiss.IndexIVFPQ(
+            quantizer, self.embedding_dim, IVF_NLIST, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT
+        )
+        logger.info(f"Training IVFPQ index on {min(total, 256 * IVF_NLIST)} vectors")
+        index.train(embeddings_array[:256 * IVF_NLIST])
+        # Keep a reference so the quantizer isn't garbage collected
+        index.quantizer_ref = quantizer
+        return index, 'ivfpq'
+
+    def _bits_per_dim(self, index_type):
+        """Return the storage bit-width per dimension for an index type"""
+        if index_type == 'ivfpq':
+            return PQ_M * PQ_NBITS / self.embedding_dim
+        return QUANTIZER_TYPES.get(self.quantization, (None, 32))[1]
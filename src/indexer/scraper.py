@@ -136,21 +136,31 @@
 Web scraper for retrieving web page content with enhanced JavaScript support
 """
 import os
+import asyncio
 import requests
 import hashlib
 import time
 import logging
 import re
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import lxml.html
+from lxml import etree
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from src.config import (
     CONTENT_DIR, SCRAPE_DELAY, SCRAPE_TIMEOUT, 
     USER_AGENT, MAX_RETRIES, EXCLUDED_DOMAINS,
-    USE_SELENIUM
+    USE_SELENIUM, SELENIUM_POOL_SIZE, SCRAPE_STORAGE
 )
 from src.database.models import HistoryModel
+from src.utils.file_utils import ShardWriter, ShardRecord
 
 logger = logging.getLogger(__name__)
 
@@ -169,6 +179,180 @@ except ImportError:
     logger.warning("Selenium not available. Install with 'pip install selenium'")
     SELENIUM_AVAILABLE = False
 
+# Try to import aiohttp - without it pages are fetched one at a time
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    logger.warning("aiohttp not available, scraping sequentially. Install with 'pip install aiohttp'")
+    AIOHTTP_AVAILABLE = False
+
+# Maximum number of concurrent requests to a single host
+HOST_CONCURRENCY = 4
+
+# Response bodies are streamed in chunks and cut off past this size
+MAX_CONTENT_BYTES = 2_000_000
+STREAM_CHUNK_SIZE = 65536
+
+# Responses worth retrying, and the random extra delay added to each backoff
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+BACKOFF_JITTER = 0.5
+
+# Timeout for the HEAD request that checks a URL's content type
+PREFLIGHT_TIMEOUT = 5
+
+# Returned in place of a content path for URLs skipped on purpose (non-HTML content),
+# which are neither failures nor a sign the domain is problematic
+SKIPPED = object()
+
+# Number of scrape results buffered before writing them to the database
+STATUS_FLUSH_SIZE = 32
+
+# User agents rotated through on retry attempts
+RETRY_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Safari/605.1.15'
+]
+
+# Query parameters that don't change the page content
+TRACKING_PARAMS = frozenset({'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_eid', 'igshid'})
+
+# Elements removed from pages before extracting text
+STRIPPED_TAGS = ("script", "style", "nav", "footer", "iframe", "header", "aside")
+
+# Text elements treated as paragraphs
+PARAGRAPH_TAGS = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "li")
+
+# XPath expressions compiled once and reused for every page
+TITLE_XPATH = etree.XPath("//title")
+BODY_XPATH = etree.XPath("//body")
+MAIN_CONTENT_XPATHS = (
+    etree.XPath("//main"),
+    etree.XPath("//article"),
+    etree.XPath("//div[contains(@class, 'content') or contains(@class, 'main') or contains(@class, 'article')]"),
+)
+PARAGRAPH_XPATH = etree.XPath(" | ".join(f".//{tag}" for tag in PARAGRAPH_TAGS))
+LEAF_DIV_XPATH = etree.XPath(
+    ".//div[not(" + " or ".join(f".//{tag}" for tag in PARAGRAPH_TAGS) + ")]"
+)
+TEXT_XPATH = etree.XPath(".//text()")
+
+# Runs of whitespace collapsed within each extracted paragraph
+MULTI_WS_RE = re.compile(r'\s+')
+
+# Charset parameter of a Content-Type header
+CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# Charset declared in a page's markup, looked for in its first bytes
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset|<\?xml[^>]+encoding', re.IGNORECASE)
+SNIFF_BYTES = 1024
+
+# Maximum number of pending files written per writer-thread wakeup
+WRITE_BATCH_SIZE = 64
+
+def _url_fingerprint(url):
+    """Return a 128-bit BLAKE2b hex digest used to name a URL's content file"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+
+def _canonicalize(url):
+    """Normalize a URL so trivial variants (fragments, tracking params, trailing slashes) compare equal"""
+    parsed = urlparse(url)
+    query = [
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.startswith('utm_') and k not in TRACKING_PARAMS
+    ]
+    return urlunparse((
+        parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/') or '/',
+        parsed.params, urlencode(query), ''
+    ))
+
+def _header_charset(content_type):
+    """Return the charset declared in a Content-Type header, if any"""
+    match = CHARSET_RE.search(content_type or '')
+    return match.group(1) if match else None
+
+def _is_html(content_type):
+    """Check whether a Content-Type header could be an HTML page (missing headers pass)"""
+    return not content_type or 'html' in content_type.lower()
+
+def _sniff_encoding(head):
+    """Guess the encoding of a page with no Content-Type charset from its first bytes
+    
+    Returns None when the markup declares its own charset so lxml can use it, and
+    UTF-8 when the bytes decode as UTF-8, instead of lxml's Latin-1 default.
+    """
+    if META_CHARSET_RE.search(head[:SNIFF_BYTES]):
+        return None
+    try:
+        # A multi-byte character may be cut off at the end of the chunk
+        head[:-3].decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return None
+
+def _capped_chunks(chunks):
+    """Yield byte chunks until MAX_CONTENT_BYTES have been read"""
+    remaining = MAX_CONTENT_BYTES
+    for chunk in chunks:
+        if len(chunk) >= remaining:
+            yield chunk[:remaining]
+            return
+        remaining -= len(chunk)
+        yield chunk
+
+def _element_text(element):
+    """Join the stripped text nodes under an element with spaces"""
+    return ' '.join(t.strip() for t in TEXT_XPATH(element) if t.strip())
+
+class WriteQueue:
+    """Write scraped files from a single background thread in batches"""
+    
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        
+    def put(self, path, data):
+        """Queue encoded content to be written to path"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="scraper-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((path, data))
+        
+    def join(self):
+        """Block until every queued file has been written"""
+        self.queue.join()
+        
+    def _run(self):
+        while True:
+            # Wait for one item, then drain whatever else is already pending
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                    
+            for path, data in batch:
+                try:
+                    self._write_file(path, data)
+                except OSError as e:
+                    logger.error(f"Error writing {path}: {e}")
+                finally:
+                    self.queue.task_done()
+                    
+    @staticmethod
+    def _write_file(path, data):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
 class WebScraper:
     """Scrape content from web pages in browsing history with JavaScript support"""
     
@@ -178,6 +362,15 @@ class WebScraper:
         self.delay = SCRAPE_DELAY
         self.max_retries = MAX_RETRIES
         self.excluded_domains = EXCLUDED_DOMAINS
+        
+        # Split excluded entries into bare hosts (set lookups) and host/path prefixes
+        self.excluded_hosts = frozenset(
+            d.lower() for d in self.excluded_domains if '/' not in d
+        )
+        self.excluded_paths = [
+            (d.split('/', 1)[0].lower(), '/' + d.split('/', 1)[1])
+            for d in self.excluded_domains if '/' in d
+        ]
         self.use_selenium = USE_SELENIUM and SELENIUM_AVAILABLE
         self.headers = {
             'User-Agent': USER_AGENT,
@@ -185,9 +378,49 @@ class WebScraper:
             'Accept-Language': 'en-US,en;q=0.9',
         }
         self.history_model = HistoryModel()
-        self.selenium_driver = None
+        self.write_queue = WriteQueue()
+        
+        # When each host was last (or will next be) requested
+        self.last_hit = {}
+        self.last_hit_lock = threading.Lock()
+        
+        # File names already on disk, listed once per domain directory
+        self.existing_files = {}
+        
+        # Domain directories known to exist
+        self.created_dirs = set()
+        
+        # Optionally append pages to shard files instead of one file per URL
+        self.shard_writer = None
+        if SCRAPE_STORAGE == 'shards':
+            self.shard_writer = ShardWriter(os.path.join(self.content_dir, 'shards'))
+        
+        # Headless browsers are started lazily and shared through a pool
+        self.pool_size = max(1, SELENIUM_POOL_SIZE)
+        self.driver_pool = queue.Queue()
+        self.drivers = []
+        self.driver_lock = threading.Lock()
         self.problematic_domains = set()
         
+        # Reuse pooled keep-alive connections across requests
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=self.max_retries,
+                backoff_factor=self.delay,
+                backoff_jitter=BACKOFF_JITTER,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=['GET', 'HEAD'],
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
         # Create content directory if it doesn't exist
         os.makedirs(self.content_dir, exist_ok=True)
         
@@ -202,25 +435,68 @@ class WebScraper:
         
     def __del__(self):
         """Cleanup when object is destroyed"""
+        self.close()
+        
+    def close(self):
+        """Close the Selenium driver, HTTP session and shard files"""
         self._close_selenium()
+        if getattr(self, 'session', None):
+            self.session.close()
+            self.session = None
+        if getattr(self, 'shard_writer', None):
+            self.shard_writer.close()
             
     def _close_selenium(self):
-        """Close Selenium driver if open"""
-        if self.selenium_driver:
-            try:
-                self.selenium_driver.quit()
-            except:
-                pass
-            self.selenium_driver = None
+        """Close all pooled Selenium drivers"""
+        with self.driver_lock:
+            for driver in self.drivers:
+                try:
+                    driver.quit()
+                except:
+                    pass
+            self.drivers = []
+            self.driver_pool = queue.Queue()
             
     def _init_selenium(self):
-        """Initialize Selenium driver"""
+        """Initialize the Selenium driver pool with its first driver"""
         if not SELENIUM_AVAILABLE:
             return False
             
-        if self.selenium_driver:
+        with self.driver_lock:
+            if self.drivers:
+                return True
+                
+            driver = self._create_driver()
+            if driver is None:
+                return False
+            self.drivers.append(driver)
+            self.driver_pool.put(driver)
             return True
             
+    @contextmanager
+    def _borrow_driver(self):
+        """Borrow a driver from the pool, starting a new one while under the pool size"""
+        try:
+            driver = self.driver_pool.get_nowait()
+        except queue.Empty:
+            driver = None
+            with self.driver_lock:
+                if len(self.drivers) < self.pool_size:
+                    driver = self._create_driver()
+                    if driver is not None:
+                        self.drivers.append(driver)
+                if not self.drivers:
+                    raise Exception("Failed to initialize Selenium")
+            if driver is None:
+                driver = self.driver_pool.get()
+                
+        try:
+            yield driver
+        finally:
+            self.driver_pool.put(driver)
+            
+    def _create_driver(self):
+        """Start a headless Chrome driver, returning None on failure"""
         try:
             chrome_options = Options()
             chrome_options.add_argument("--headless")
@@ -234,17 +510,17 @@ class WebScraper:
             # Set shorter page load timeout for better performance
             chrome_options.page_load_strategy = 'eager'
             
-            # self.selenium_driver = webdriver.Chrome(options=chrome_options)
-            self.selenium_driver = webdriver.Chrome(
+            # driver = webdriver.Chrome(options=chrome_options)
+            driver = webdriver.Chrome(
                     service=Service(ChromeDriverManager().install()),
                     options=chrome_options
                 )
-            self.selenium_driver.set_page_load_timeout(self.timeout)
+            driver.set_page_load_timeout(self.timeout)
             
-            return True
+            return driver
         except Exception as e:
             logger.error(f"Error initializing Selenium: {e}")
-            return False
+            return None
     
     def scrape_unprocessed_pages(self, limit=50):
         """Scrape all unprocessed pages in the history database"""
@@ -257,6 +533,30 @@ class WebScraper:
             
         successful_count = 0
         failed_count = 0
+        skipped_count = 0
+        
+        # Re-list domain directories on each run
+        self.existing_files = {}
+        
+        # Status updates are buffered and written in batches
+        success_buf = []
+        fail_buf = []
+        skip_buf = []
+        
+        def _flush():
+            # Make sure files exist on disk before recording their paths
+            self.write_queue.join()
+            if self.shard_writer:
+                self.shard_writer.flush()
+            if success_buf:
+                self.history_model.update_scraped_status_bulk(success_buf)
+                success_buf.clear()
+            if fail_buf:
+                self.history_model.update_scrape_failed_bulk(fail_buf)
+                fail_buf.clear()
+            if skip_buf:
+                self.history_model.mark_skipped_bulk(skip_buf)
+                skip_buf.clear()
         
         # Pre-filter URLs from problematic domains
         filtered_urls = []
@@ -265,11 +565,27 @@ class WebScraper:
             if domain in self.problematic_domains:
                 logger.info(f"Skipping URL from problematic domain: {url}")
                 # Mark as attempted but failed
-                if hasattr(self.history_model, 'update_scrape_failed'):
-                    self.history_model.update_scrape_failed(url_id)
+                fail_buf.append(url_id)
                 failed_count += 1
             else:
                 filtered_urls.append((url_id, url))
+        _flush()
+        
+        # Collapse URLs that point at the same page, scraping only the first of each
+        seen = {}
+        duplicate_ids = []
+        for url_id, url in filtered_urls:
+            canonical = _canonicalize(url)
+            if canonical in seen:
+                logger.info(f"Skipping duplicate of history entry {seen[canonical][0]}: {url}")
+                duplicate_ids.append(url_id)
+            else:
+                seen[canonical] = (url_id, url)
+        filtered_urls = list(seen.values())
+        
+        if duplicate_ids:
+            self.history_model.mark_duplicates_bulk(duplicate_ids)
+            logger.info(f"Skipped {len(duplicate_ids)} duplicate URLs")
                 
         logger.info(f"Filtered out {len(unscraped_urls) - len(filtered_urls)} URLs from problematic domains")
         
@@ -283,42 +599,51 @@ class WebScraper:
         # Track newly discovered problematic domains
         new_problematic_domains = set()
         
-        for url_id, url in filtered_urls:
-            try:
-                # Add delay to be respectful
-                time.sleep(self.delay)
-                
-                # Scrape the page
-                content_path = self.scrape_url(url, url_id)
-                
-                if content_path:
+        # Load pages across the browser pool with Selenium, otherwise fetch
+        # them concurrently when aiohttp is available
+        if self.use_selenium:
+            outcomes = self._scrape_urls_pooled(filtered_urls)
+        elif AIOHTTP_AVAILABLE:
+            outcomes = asyncio.run(self._scrape_urls_async(filtered_urls))
+        else:
+            outcomes = self._scrape_urls_sequential(filtered_urls)
+        
+        try:
+            for i, (url_id, url, content_path, error) in enumerate(outcomes, 1):
+                if error is not None:
+                    logger.error(f"Error scraping {url}: {error}")
+                    
+                    # Add domain to problematic list after exception
+                    new_problematic_domains.add(urlparse(url).netloc)
+                elif content_path is SKIPPED:
+                    skip_buf.append(url_id)
+                    skipped_count += 1
+                elif content_path:
                     # Update the scraped status
-                    self.history_model.update_scraped_status(url_id, content_path)
+                    if isinstance(content_path, ShardRecord):
+                        success_buf.append((url_id, *content_path))
+                    else:
+                        success_buf.append((url_id, content_path, None, None, None))
                     successful_count += 1
                     logger.info(f"Successfully scraped: {url}")
                 else:
-                    # Update as failed if method exists
-                    if hasattr(self.history_model, 'update_scrape_failed'):
-                        self.history_model.update_scrape_failed(url_id)
+                    # Update as failed
+                    fail_buf.append(url_id)
                     failed_count += 1
                     logger.warning(f"Failed to scrape: {url}")
                     
                     # Add domain to problematic list after failure
-                    domain = urlparse(url).netloc
-                    new_problematic_domains.add(domain)
+                    new_problematic_domains.add(urlparse(url).netloc)
                     
-            except Exception as e:
-                logger.error(f"Error scraping {url}: {e}")
-                failed_count += 1
-                
-                # Add domain to problematic list after exception
-                domain = urlparse(url).netloc
-                new_problematic_domains.add(domain)
+                if i % STATUS_FLUSH_SIZE == 0:
+                    _flush()
+        finally:
+            _flush()
                 
         # Clean up Selenium
         self._close_selenium()
             
-        logger.info(f"Scraped {successful_count}/{len(filtered_urls)} pages, {failed_count} failures")
+        logger.info(f"Scraped {successful_count}/{len(filtered_urls)} pages, {failed_count} failures, {skipped_count} non-HTML skipped")
         
         # Update problematic domains
         if new_problematic_domains:
@@ -332,18 +657,127 @@ class WebScraper:
         
         return successful_count
         
-    def scrape_url(self, url, url_id=None):
-        """Scrape content from a URL and save to disk"""
+    def _scrape_one(self, url_id, url):
+        """Scrape a single URL, returning a (url_id, url, content_path, error) tuple"""
+        try:
+            # Add delay to be respectful to this host
+            time.sleep(self._politeness_wait(urlparse(url).netloc))
+            
+            # Scrape the page
+            return url_id, url, self.scrape_url(url, url_id), None
+        except Exception as e:
+            return url_id, url, None, e
+            
+    def _politeness_wait(self, host):
+        """Reserve the next request slot for a host and return how long to wait for it
+        
+        Requests to the same host are spaced self.delay apart, while different
+        hosts don't wait on each other.
+        """
+        with self.last_hit_lock:
+            now = time.monotonic()
+            slot = max(now, self.last_hit.get(host, now - self.delay) + self.delay)
+            self.last_hit[host] = slot
+        return slot - now
+        
+    def _scrape_urls_sequential(self, urls):
+        """Scrape URLs one at a time"""
+        return [self._scrape_one(url_id, url) for url_id, url in urls]
+        
+    def _scrape_urls_pooled(self, urls):
+        """Scrape URLs on one thread per pooled Selenium driver"""
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            return list(executor.map(lambda item: self._scrape_one(*item), urls))
+        
+    async def _scrape_urls_async(self, urls):
+        """Scrape URLs concurrently, limiting the requests in flight to each host"""
+        semaphores = {}
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        
+        async with aiohttp.ClientSession(headers=self.headers, timeout=timeout) as session:
+            async def bounded(url_id, url):
+                host = urlparse(url).netloc
+                semaphore = semaphores.setdefault(host, asyncio.Semaphore(HOST_CONCURRENCY))
+                async with semaphore:
+                    # Add delay to be respectful to this host
+                    await asyncio.sleep(self._politeness_wait(host))
+                    try:
+                        content_path = await self._scrape_url_async(session, url_id, url)
+                        return url_id, url, content_path, None
+                    except Exception as e:
+                        return url_id, url, None, e
+                        
+            return await asyncio.gather(*(bounded(url_id, url) for url_id, url in urls))
+        
+    async def _scrape_url_async(self, session, url_id, url):
+        """Scrape content from a URL with aiohttp and save to disk"""
+        output_path = self._output_path(url, url_id)
+        if not output_path:
+            return None
+            
+        # Check if already scraped
+        if self._already_scraped(output_path):
+            logger.info(f"Already scraped: {url}")
+            return output_path
+            
+        # Skip downloads, images and other non-HTML content
+        try:
+            async with session.head(
+                url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=min(PREFLIGHT_TIMEOUT, self.timeout))
+            ) as head:
+                if head.status < 400 and not _is_html(head.headers.get('Content-Type')):
+                    logger.info(f"Skipping non-HTML content ({head.headers.get('Content-Type')}): {url}")
+                    return SKIPPED
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Some sites reject HEAD, fall through to GET
+            pass
+            
+        loop = asyncio.get_running_loop()
+        
+        for attempt in range(self.max_retries):
+            try:
+                async with session.get(url, headers=self._request_headers(attempt)) as response:
+                    if response.status == 403:
+                        # If we get a 403 Forbidden, don't retry - site is blocking us
+                        logger.warning(f"Site is blocking scraping (403 Forbidden): {url}")
+                        return None
+                    response.raise_for_status()
+                    
+                    # Read the body in chunks, stopping at the size cap
+                    chunks = []
+                    remaining = MAX_CONTENT_BYTES
+                    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        chunks.append(chunk[:remaining])
+                        remaining -= len(chunk)
+                        if remaining <= 0:
+                            break
+                    charset = response.charset
+                    
+                # Parse and save off the event loop so other fetches keep running
+                return await loop.run_in_executor(
+                    None, lambda: self._process_content(self._parse_chunks(chunks, charset), output_path)
+                )
+                
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES:
+                    logger.warning(f"Failed to scrape {url}: {e}")
+                    return None
+                logger.warning(f"Attempt {attempt+1}/{self.max_retries} failed for {url}: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+                
+            except Exception as e:
+                logger.warning(f"Attempt {attempt+1}/{self.max_retries} failed for {url}: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+                
+        logger.error(f"Failed to scrape after {self.max_retries} attempts: {url}")
+        return None
+        
+    def _output_path(self, url, url_id=None):
+        """Return the file path for a URL's content, or None if it shouldn't be scraped"""
         if not url_id:
             # Generate an ID if not provided
-            url_id = hashlib.md5(url.encode()).hexdigest()
+            url_id = _url_fingerprint(url)
             
-        # Check if URL contains any excluded domains
-        for domain in self.excluded_domains:
-            if domain in url:
-                logger.info(f"Skipping excluded domain in URL: {url}")
-                return None
-                
         # Parse URL to get domain
         parsed_url = urlparse(url)
         domain = parsed_url.netloc
@@ -352,18 +786,91 @@ class WebScraper:
             logger.warning(f"Invalid URL: {url}")
             return None
             
-        # Create domain directory
+        # Check if URL belongs to any excluded domains
+        if self._is_excluded(parsed_url):
+            logger.info(f"Skipping excluded domain in URL: {url}")
+            return None
+            
+        # Create domain directory, unless pages go to shard files
         domain_dir = os.path.join(self.content_dir, domain)
-        os.makedirs(domain_dir, exist_ok=True)
+        if not self.shard_writer and domain_dir not in self.created_dirs:
+            os.makedirs(domain_dir, exist_ok=True)
+            self.created_dirs.add(domain_dir)
+        
+        return os.path.join(domain_dir, f"{url_id}.html")
         
-        # Output path
-        output_path = os.path.join(domain_dir, f"{url_id}.html")
+    def _is_excluded(self, parsed_url):
+        """Check a parsed URL's host and its parent domains against the excluded domains"""
+        host = (parsed_url.hostname or '').lower()
+        parts = host.split('.')
+        suffixes = {'.'.join(parts[i:]) for i in range(len(parts))}
+        
+        if not suffixes.isdisjoint(self.excluded_hosts):
+            return True
+            
+        # Entries with a path only exclude URLs under that path
+        path = parsed_url.path or '/'
+        return any(
+            excluded_host in suffixes and path.startswith(excluded_path)
+            for excluded_host, excluded_path in self.excluded_paths
+        )
+        
+    def _already_scraped(self, output_path):
+        """Check whether a content file exists, listing its directory on first use"""
+        if self.shard_writer:
+            # Sharded pages are tracked by the database alone
+            return False
+            
+        directory, name = os.path.split(output_path)
+        names = self.existing_files.get(directory)
+        if names is None:
+            names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+            self.existing_files[directory] = names
+        return name in names
+        
+    def _preflight(self, url):
+        """Send a HEAD request and return False if the URL isn't an HTML page"""
+        try:
+            head = self.session.head(url, allow_redirects=True, timeout=min(PREFLIGHT_TIMEOUT, self.timeout))
+        except requests.RequestException:
+            # Some sites reject HEAD, fall through to GET
+            return True
+            
+        content_type = head.headers.get('Content-Type')
+        if head.ok and not _is_html(content_type):
+            logger.info(f"Skipping non-HTML content ({content_type}): {url}")
+            return False
+        return True
+        
+    def _backoff(self, attempt):
+        """Exponential backoff with jitter, matching the session's urllib3 retries"""
+        return self.delay * (2 ** attempt) + random.uniform(0, BACKOFF_JITTER)
+        
+    def _request_headers(self, attempt):
+        """Return request headers, varying the user agent on retries to avoid detection"""
+        headers = self.headers.copy()
+        if attempt > 0:
+            headers['User-Agent'] = RETRY_USER_AGENTS[attempt % len(RETRY_USER_AGENTS)]
+        return headers
+        
+    def scrape_url(self, url, url_id=None):
+        """Scrape content from a URL and save to disk
+        
+        Returns the content path, SKIPPED for non-HTML content, or None on failure.
+        """
+        output_path = self._output_path(url, url_id)
+        if not output_path:
+            return None
         
         # Check if already scraped
-        if os.path.exists(output_path):
+        if self._already_scraped(output_path):
             logger.info(f"Already scraped: {url}")
             return output_path
             
+        # Skip downloads, images and other non-HTML content
+        if not self._preflight(url):
+            return SKIPPED
+            
         # Try with Selenium first if enabled
         if self.use_selenium:
             try:
@@ -376,76 +883,47 @@ class WebScraper:
                 logger.warning(f"Selenium scraping failed for {url}: {e}")
                 # Fall back to requests
                 
-        # Scrape with requests and retries
-        for attempt in range(self.max_retries):
-            try:
-                # Vary user agent to avoid detection
-                headers = self.headers.copy()
-                if attempt > 0:
-                    # Try a different user agent for retry attempts
-                    user_agents = [
-                        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
-                        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Safari/605.1.15'
-                    ]
-                    headers['User-Agent'] = user_agents[attempt % len(user_agents)]
-                
-                # Make the request
-                response = requests.get(
-                    url, 
-                    headers=headers, 
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                
-                # Parse with BeautifulSoup
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Process the content
-                return self._process_content(soup, output_path)
-                
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 403:
-                    # If we get a 403 Forbidden, don't retry - site is blocking us
+        # Scrape with requests, retries are handled by the session's adapter
+        try:
+            # Make the request, streaming the body into the parser
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 403:
+                    # If we get a 403 Forbidden, site is blocking us
                     logger.warning(f"Site is blocking scraping (403 Forbidden): {url}")
                     return None
-                else:
-                    logger.warning(f"Attempt {attempt+1}/{self.max_retries} failed for {url}: {e}")
-                    time.sleep(self.delay * (attempt + 1))  # Exponential backoff
-                    
-            except Exception as e:
-                logger.warning(f"Attempt {attempt+1}/{self.max_retries} failed for {url}: {e}")
-                time.sleep(self.delay * (attempt + 1))  # Exponential backoff
-                    
-        logger.error(f"Failed to scrape after {self.max_retries} attempts: {url}")
-        return None
+                response.raise_for_status()
+                tree = self._parse_chunks(
+                    _capped_chunks(response.iter_content(STREAM_CHUNK_SIZE)),
+                    _header_charset(response.headers.get('Content-Type'))
+                )
+            
+            # Process the content
+            return self._process_content(tree, output_path)
+            
+        except Exception as e:
+            logger.error(f"Failed to scrape {url}: {e}")
+            return None
     
     def _scrape_with_selenium(self, url, output_path):
         """Scrape a page using Selenium for JavaScript support"""
-        if not self.selenium_driver:
-            if not self._init_selenium():
-                raise Exception("Failed to initialize Selenium")
-                
         try:
-            # Navigate to the page
-            self.selenium_driver.get(url)
-            
-            # Wait for page to load
-            WebDriverWait(self.selenium_driver, 10).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            
-            # Scroll to get dynamic content
-            self._scroll_page()
-            
-            # Get the page source
-            html = self.selenium_driver.page_source
-            
-            # Parse with BeautifulSoup
-            soup = BeautifulSoup(html, 'html.parser')
+            with self._borrow_driver() as driver:
+                # Navigate to the page
+                driver.get(url)
+                
+                # Wait for page to load
+                WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.TAG_NAME, "body"))
+                )
+                
+                # Scroll to get dynamic content
+                self._scroll_page(driver)
+                
+                # Get the page source
+                html = driver.page_source
             
-            # Process the content
-            return self._process_content(soup, output_path)
+            # Parse and process the content
+            return self._process_content(self._parse_html(html), output_path)
             
         except TimeoutException:
             logger.warning(f"Selenium timeout for {url}")
@@ -455,22 +933,22 @@ class WebScraper:
             logger.warning(f"Selenium error for {url}: {e}")
             return None
     
-    def _scroll_page(self):
+    def _scroll_page(self, driver):
         """Scroll the page to load dynamic content"""
         try:
             # Get scroll height
-            last_height = self.selenium_driver.execute_script("return document.body.scrollHeight")
+            last_height = driver.execute_script("return document.body.scrollHeight")
             
             # Scroll down to bottom in steps
             for _ in range(3):  # Limit to 3 scrolls for performance
                 # Scroll down
-                self.selenium_driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
                 
                 # Wait to load page
                 time.sleep(1)
                 
                 # Calculate new scroll height and compare with last scroll height
-                new_height = self.selenium_driver.execute_script("return document.body.scrollHeight")
+                new_height = driver.execute_script("return document.body.scrollHeight")
                 if new_height == last_height:
                     break
                 last_height = new_height
@@ -478,58 +956,103 @@ class WebScraper:
         except Exception as e:
             logger.warning(f"Error scrolling page: {e}")
     
-    def _process_content(self, soup, output_path):
+    def _parse_html(self, html):
+        """Parse an HTML document with lxml, returning None if it is empty"""
+        # Decoded text is re-encoded so lxml doesn't trip over XML encoding declarations
+        if isinstance(html, str):
+            return self._parse_chunks([html.encode('utf-8')], 'utf-8')
+        return self._parse_chunks([html])
+        
+    def _parse_chunks(self, chunks, encoding=None):
+        """Feed byte chunks to an lxml parser, returning None if the document is empty"""
+        chunks = iter(chunks)
+        head = b''
+        if encoding is None:
+            # Streamed chunks can be a few bytes long, so sniff at least SNIFF_BYTES
+            buffered = []
+            buffered_bytes = 0
+            for chunk in chunks:
+                buffered.append(chunk)
+                buffered_bytes += len(chunk)
+                if buffered_bytes >= SNIFF_BYTES:
+                    break
+            head = b''.join(buffered)
+            encoding = _sniff_encoding(head)
+            
+        # Parsers aren't thread-safe, so each page gets its own. Without a declared
+        # encoding lxml falls back to the document's meta charset
+        try:
+            parser = lxml.html.HTMLParser(remove_blank_text=True, encoding=encoding)
+        except LookupError:
+            parser = lxml.html.HTMLParser(remove_blank_text=True)
+            
+        parser.feed(head)
+        for chunk in chunks:
+            parser.feed(chunk)
+            
+        try:
+            return parser.close()
+        except etree.XMLSyntaxError:
+            return None
+    
+    def _process_content(self, tree, output_path):
         """Process and save the content"""
+        if tree is None:
+            return None
+            
         # Get the title
-        title_elem = soup.find('title')
-        title = title_elem.get_text() if title_elem else "No Title"
+        title_elems = TITLE_XPATH(tree)
+        title = title_elems[0].text_content() if title_elems else "No Title"
         
-        # Remove unwanted elements
-        for element in soup(["script", "style", "nav", "footer", "iframe", "header", "aside"]):
-            element.decompose()
+        # Remove unwanted elements, keeping the text that follows them
+        etree.strip_elements(tree, *STRIPPED_TAGS, with_tail=False)
             
-        # Find the main content
-        main_content = soup.find("main") or soup.find("article") or soup.find("div", class_=re.compile("content|main|article"))
-        
-        # If no main content found, use the body
-        content = main_content or soup.body or soup
+        # Find the main content, falling back to the body
+        content = None
+        for xpath in MAIN_CONTENT_XPATHS + (BODY_XPATH,):
+            matches = xpath(tree)
+            if matches:
+                content = matches[0]
+                break
+        if content is None:
+            content = tree
         
         # Get all text from paragraphs
         paragraphs = []
-        for p in content.find_all(["p", "h1", "h2", "h3", "h4", "h5", "h6", "li"]):
-            text = p.get_text(separator=' ', strip=True)
+        for p in PARAGRAPH_XPATH(content):
+            text = _element_text(p)
             if text and len(text) > 20:  # Skip very short paragraphs
                 paragraphs.append(text)
                 
-        # Get text from divs if not enough paragraphs found
+        # Get text from divs if not enough paragraphs found, skipping divs
+        # that contain other text elements to avoid duplication
         if len(paragraphs) < 5:
-            for div in content.find_all("div"):
-                if div.find(["p", "h1", "h2", "h3", "h4", "h5", "h6", "li"]):
-                    # Skip divs that contain other text elements to avoid duplication
-                    continue
-                    
-                text = div.get_text(separator=' ', strip=True)
+            for div in LEAF_DIV_XPATH(content):
+                text = _element_text(div)
                 if text and len(text) > 50:  # Skip shorter divs
                     paragraphs.append(text)
                     
         # If still not enough content, get all text
         if len(' '.join(paragraphs)) < 200:
-            main_text = content.get_text(separator='\n', strip=True)
+            main_text = '\n'.join(t.strip() for t in TEXT_XPATH(content) if t.strip())
             paragraphs = [line.strip() for line in main_text.splitlines() if line.strip()]
             
-        # Combine paragraphs with newlines
-        text = '\n\n'.join(paragraphs)
-        
-        # Clean up extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = '\n\n'.join(line.strip() for line in text.splitlines() if line.strip())
+        # Collapse whitespace inside each paragraph, keeping the breaks between them
+        paragraphs = [MULTI_WS_RE.sub(' ', p).strip() for p in paragraphs]
+        text = '\n\n'.join(p for p in paragraphs if p)
         
         # Combine title and content
         full_content = f"Title: {title}\n\n{text}"
         
-        # Save to file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(full_content)
+        data = full_content.encode('utf-8')
+        
+        # Append to a shard, keyed by the file name the page would have had
+        if self.shard_writer:
+            return self.shard_writer.append(os.path.basename(output_path), data)
+            
+        # Hand the file to the writer thread
+        self.write_queue.put(output_path, data)
+        directory, name = os.path.split(output_path)
+        self.existing_files.setdefault(directory, set()).add(name)
             
         return output_path
-
@@ -2,15 +2,158 @@
 """
 Cache LLM responses to improve performance
 """
-import hashlib
+import atexit
 import logging
+import re
+import threading
+import zlib
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 
-from src.config import CACHE_RESPONSES
-from src.database.models import LLMCacheModel
+import numpy as np
+
+from src.config import CACHE_RESPONSES, SEMANTIC_CACHE, SEMANTIC_CACHE_THRESHOLD
+from src.database.models import LLMCacheModel, query_fingerprint
+from src.llm.prompt_builder import IM_END, IM_START_USER
 
 logger = logging.getLogger(__name__)
 
+# Try to import datasketch - without it only exact prompt matches are cached
+try:
+    from datasketch import MinHash, MinHashLSH
+    DATASKETCH_AVAILABLE = True
+except ImportError:
+    logger.warning("datasketch not available, semantic LLM cache disabled. Install with 'pip install datasketch'")
+    DATASKETCH_AVAILABLE = False
+
+# Try to import numba - without it MinHash signatures are computed by datasketch
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    logger.warning("numba not available, using datasketch MinHash hashing. Install with 'pip install numba'")
+    NUMBA_AVAILABLE = False
+
+# Recent lookups kept in memory in front of the database, shared by every LLMCache
+# since a new one is created for each request
+LRU_CACHE_SIZE = 1024
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+# Pending responses are written once this many are buffered, or every interval
+WRITE_BATCH_SIZE = 32
+FLUSH_INTERVAL = 2.0  # seconds
+
+# Responses waiting to be written, keyed by prompt fingerprint. Shared by every
+# LLMCache so one flusher thread serves the whole process however many are created
+_write_buf = {}
+_buf_lock = threading.Lock()
+_flusher = None
+_flusher_lock = threading.Lock()
+_stop_flushing = threading.Event()
+
+# MinHash settings for matching near-identical questions
+MINHASH_NUM_PERM = 64
+SHINGLE_SIZE = 5
+SEMANTIC_CACHE_SIZE = 1024
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# 32-bit hashing constants, typed so numba keeps the arithmetic in uint64
+HASH_MASK = np.uint64(0xffffffff)
+FNV_OFFSET = np.uint64(0x811c9dc5)
+FNV_PRIME = np.uint64(0x01000193)
+FMIX_C1 = np.uint64(0x85ebca6b)
+FMIX_C2 = np.uint64(0xc2b2ae35)
+SHIFT_13 = np.uint64(13)
+SHIFT_16 = np.uint64(16)
+
+def _shingle_signature(token_hashes, shingle_size, a, b):
+    """Minimum permuted hash of every shingle of consecutive token hashes, per permutation"""
+    num_tokens = len(token_hashes)
+    signature = np.full(len(a), HASH_MASK, dtype=np.uint64)
+    for i in range(max(1, num_tokens - shingle_size + 1)):
+        # FNV-1a over the shingle's token hashes, finished with murmur3's fmix32
+        h = FNV_OFFSET
+        for t in range(i, min(i + shingle_size, num_tokens)):
+            h = ((h ^ token_hashes[t]) * FNV_PRIME) & HASH_MASK
+        h ^= h >> SHIFT_16
+        h = (h * FMIX_C1) & HASH_MASK
+        h ^= h >> SHIFT_13
+        h = (h * FMIX_C2) & HASH_MASK
+        h ^= h >> SHIFT_16
+        
+        for j in range(len(a)):
+            permuted = (a[j] * h + b[j]) & HASH_MASK
+            if permuted < signature[j]:
+                signature[j] = permuted
+    return signature
+
+if NUMBA_AVAILABLE:
+    _shingle_signature = njit(cache=True)(_shingle_signature)
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm):
+    """datasketch's permutation parameters, widened for the signature kernel, and their scheme"""
+    reference = MinHash(num_perm=num_perm)
+    a, b = reference.permutations.astype(np.uint64)
+    return a, b, reference.scheme
+
+def text_minhash(text, num_perm=MINHASH_NUM_PERM):
+    """MinHash of the word 5-gram shingles of a text"""
+    tokens = TOKEN_RE.findall(text.lower())
+    
+    if NUMBA_AVAILABLE:
+        token_hashes = np.array([zlib.crc32(token.encode('utf-8')) for token in tokens], dtype=np.uint64)
+        a, b, scheme = _permutations(num_perm)
+        signature = _shingle_signature(token_hashes, SHINGLE_SIZE, a, b)
+        return MinHash(num_perm=num_perm, hashvalues=signature.astype(np.uint32), scheme=scheme)
+        
+    shingles = {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    minhash = MinHash(num_perm=num_perm)
+    minhash.update_batch([s.encode('utf-8') for s in shingles])
+    return minhash
+
+def flush_pending():
+    """Write buffered responses to the database in one transaction"""
+    with _buf_lock:
+        if not _write_buf:
+            return
+        rows = list(_write_buf.values())
+        _write_buf.clear()
+        
+    try:
+        LLMCacheModel().cache_response_bulk(rows)
+        logger.info(f"Flushed {len(rows)} cached LLM responses")
+    except Exception as e:
+        logger.error(f"Error flushing cached responses: {e}")
+        
+def _flush_periodically():
+    while not _stop_flushing.wait(FLUSH_INTERVAL):
+        flush_pending()
+        
+def start_flusher():
+    """Start the background flusher thread, unless it is already running"""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is not None and _flusher.is_alive():
+            return
+        _stop_flushing.clear()
+        _flusher = threading.Thread(target=_flush_periodically, name="llm-cache-flush", daemon=True)
+        _flusher.start()
+        
+def stop_flusher():
+    """Stop the background flusher thread and write out anything still buffered"""
+    global _flusher
+    with _flusher_lock:
+        flusher, _flusher = _flusher, None
+        _stop_flushing.set()
+    if flusher is not None:
+        flusher.join()
+    flush_pending()
+    
+atexit.register(stop_flusher)
+
 class LLMCache:
     """Cache LLM responses to improve performance"""
     
@@ -18,13 +161,22 @@ class LLMCache:
         self.use_cache = CACHE_RESPONSES
         self.db_model = LLMCacheModel()
         
+        if self.use_cache:
+            start_flusher()
+        
     def cache_response(self, prompt, response):
         """Cache an LLM response"""
         if not self.use_cache:
             return
             
         try:
-            self.db_model.cache_response(prompt, response)
+            prompt_hash = query_fingerprint(prompt)
+            self._remember(prompt_hash, response)
+            with _buf_lock:
+                _write_buf[prompt_hash] = (prompt, response)
+                batch_full = len(_write_buf) >= WRITE_BATCH_SIZE
+            if batch_full:
+                self.flush()
             logger.info("Cached LLM response")
             
         except Exception as e:
@@ -36,11 +188,119 @@ class LLMCache:
             return None
             
         try:
-            response = self.db_model.get_cached_response(prompt)
+            prompt_hash = query_fingerprint(prompt)
+            with _lru_lock:
+                if prompt_hash in _lru:
+                    _lru.move_to_end(prompt_hash)
+                    response = _lru[prompt_hash]
+                    if response:
+                        logger.info("Found cached LLM response in memory")
+                    return response
+                    
+            # Responses not yet flushed are served from the write buffer
+            with _buf_lock:
+                pending = _write_buf.get(prompt_hash)
+            if pending:
+                logger.info("Found cached LLM response in memory")
+                return pending[1]
+                
+            response = self.db_model.get_cached_response_by_hash(prompt_hash)
+            self._remember(prompt_hash, response)
             if response:
                 logger.info("Found cached LLM response")
             return response
             
         except Exception as e:
             logger.error(f"Error getting cached response: {e}")
-            return None
\ No newline at end of file
+            return None
+            
+    def _remember(self, prompt_hash, response):
+        """Store a lookup result in the in-memory LRU, evicting the oldest entry"""
+        with _lru_lock:
+            _lru[prompt_hash] = response
+            _lru.move_to_end(prompt_hash)
+            if len(_lru) > LRU_CACHE_SIZE:
+                _lru.popitem(last=False)
+                
+    def flush(self):
+        """Write buffered responses to the database in one transaction"""
+        flush_pending()
+        
+
+def split_prompt(prompt):
+    """Split a chat prompt into everything before its last user turn (system prompt and
+    retrieved context) and the text of that turn, or None if it has no user turn"""
+    context, boundary, turn = prompt.rpartition(IM_START_USER)
+    if not boundary:
+        return None
+    return context, turn.partition(IM_END)[0]
+
+class SemanticLLMCache:
+    """Reuse responses for near-duplicate questions asked over exactly the same context.
+    
+    Similarity is measured on the question alone: the system prompt and retrieved
+    context make up most of a prompt, so comparing whole prompts would match
+    different questions about the same pages.
+    """
+    
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.enabled = CACHE_RESPONSES and SEMANTIC_CACHE and DATASKETCH_AVAILABLE
+        self.threshold = threshold
+        self.entries = OrderedDict()  # prompt hash -> (context hash, question minhash, response)
+        self.lock = threading.Lock()
+        if self.enabled:
+            self.lsh = MinHashLSH(threshold=threshold, num_perm=MINHASH_NUM_PERM)
+            
+    def get_cached_response(self, prompt):
+        """Get the response to the most similar cached question above the threshold
+        that was asked with the same context"""
+        if not self.enabled:
+            return None
+            
+        parts = split_prompt(prompt)
+        if parts is None:
+            return None
+        context_hash = query_fingerprint(parts[0])
+        minhash = text_minhash(parts[1])
+        
+        with self.lock:
+            best_response, best_similarity = None, self.threshold
+            for key in self.lsh.query(minhash):
+                candidate_context, candidate, response = self.entries[key]
+                if candidate_context != context_hash:
+                    continue
+                similarity = minhash.jaccard(candidate)
+                if similarity >= best_similarity:
+                    best_response, best_similarity = response, similarity
+                    
+        if best_response:
+            logger.info(f"Found semantically cached LLM response (similarity {best_similarity:.2f})")
+        return best_response
+        
+    def cache_response(self, prompt, response):
+        """Index a prompt's response, evicting the oldest entry when full"""
+        if not self.enabled:
+            return
+            
+        parts = split_prompt(prompt)
+        if parts is None:
+            return
+        key = query_fingerprint(prompt)
+        context_hash = query_fingerprint(parts[0])
+        minhash = text_minhash(parts[1])
+        
+        with self.lock:
+            if key in self.entries:
+                self.lsh.remove(key)
+            self.lsh.insert(key, minhash)
+            self.entries[key] = (context_hash, minhash, response)
+            self.entries.move_to_end(key)
+            
+            if len(self.entries) > SEMANTIC_CACHE_SIZE:
+                oldest, _ = self.entries.popitem(last=False)
+                self.lsh.remove(oldest)
+
+# One semantic cache per process, so it can hit across requests
+@lru_cache(maxsize=None)
+def get_semantic_cache():
+    return SemanticLLMCache()
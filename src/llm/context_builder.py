@@ -2,44 +2,123 @@
 """
 Enhanced context builder with improved time awareness and relevance scoring
 """
+import hashlib
 import logging
 import re
+import threading
+import numpy as np
 from datetime import datetime, timedelta
+from functools import lru_cache
 from urllib.parse import urlparse
-from collections import Counter
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from src.config import MAX_CONTEXT_CHUNKS
 from src.searcher.query_processor import QueryProcessor
 from src.searcher.retriever import HistoryRetriever
 from src.searcher.reranker import SearchReranker
 from src.database.models import HistoryModel
+from src.llm.cache import DATASKETCH_AVAILABLE, text_minhash
+from src.utils.text_utils import KEYWORD_STOPWORDS
+
+if DATASKETCH_AVAILABLE:
+    from datasketch import MinHashLSH
 
 logger = logging.getLogger(__name__)
 
+# Minimum Jaccard similarity for two chunks to count as near-duplicates, and the
+# MinHash permutations used (64 bands too coarsely to catch pairs near the threshold)
+DUPLICATE_THRESHOLD = 0.85
+DUPLICATE_NUM_PERM = 128
+
+# Prefix of normalized chunk text hashed when datasketch isn't available
+DUPLICATE_PREFIX_CHARS = 4096
+
+# Explicit time frames ("in the last 3 weeks") and domain mentions ("on github.com")
+TIME_FRAME_RE = re.compile(r'(?:in|the|last|past)\s+(\d+)\s+(day|days|week|weeks|month|months)', re.I)
+DOMAIN_RE = re.compile(r'(?:on|about|from|at)\s+([a-zA-Z0-9.-]+\.[a-zA-Z]{2,})')
+
+# Common time references and the number of days they cover, in priority order
+TIME_PATTERNS = {
+    'today': 1,
+    'yesterday': 2,
+    'this week': 7,
+    'past week': 7,
+    'last week': 14,
+    'this month': 30,
+    'past month': 30,
+    'recent': 14,
+    'recently': 14,
+    'past few days': 5,
+    'last few days': 5
+}
+TIME_PATTERN_PRIORITY = {phrase: i for i, phrase in enumerate(TIME_PATTERNS)}
+# Longer phrases first so "recently" is not cut short at "recent"
+TIME_PATTERN_RE = re.compile('|'.join(re.escape(p) for p in sorted(TIME_PATTERNS, key=len, reverse=True)), re.I)
+# Words that make a query time-based even without a specific time reference
+TIME_HINT_RE = re.compile(r'recent|lately|been|interested', re.I)
+
+# Phrases that mark a query as asking for an activity summary
+ACTIVITY_TERMS_RE = re.compile(
+    r'what have i|been doing|looked at|searched for|browsing history|activity|visited|browsed'
+    r'|been reading|been researching|been interested in|topics|summary|overview',
+    re.I
+)
+
+# Number of distinct queries whose keywords are memoized
+QUERY_CACHE_SIZE = 512
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _keywords(text):
+    """Extract keywords from text, memoized since the same query is seen repeatedly"""
+    return tuple(w for w in text.lower().split() if w not in KEYWORD_STOPWORDS and len(w) > 2)
+
+def _normalize_query(query):
+    """Normalize case and whitespace so trivially different queries share a cache entry"""
+    return ' '.join(query.lower().split())
+
+# Runs the vector search alongside direct database lookups
+SEARCH_WORKERS = 4
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="context-search")
+
+@lru_cache(maxsize=2048)
+def _parse_iso(timestamp):
+    """Parse an ISO timestamp, memoized since chunks of the same page share one"""
+    return datetime.fromisoformat(timestamp)
+
+# Search components are created once per process and shared by every ContextBuilder
+@lru_cache(maxsize=None)
+def get_query_processor():
+    return QueryProcessor()
+
+# The shared retriever is replaced once the index on disk has been rebuilt, e.g.
+# by index_job, so chat keeps searching the current index without a restart
+_retriever = None
+_retriever_lock = threading.Lock()
+
+def get_retriever():
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None or _retriever.is_stale():
+            _retriever = HistoryRetriever()
+        return _retriever
+
+@lru_cache(maxsize=None)
+def get_reranker():
+    return SearchReranker()
+
 class ContextBuilder:
     """Build context for RAG by retrieving and ranking relevant chunks with enhanced time awareness"""
     
     def __init__(self):
         self.max_context_chunks = MAX_CONTEXT_CHUNKS
-        self.query_processor = QueryProcessor()
-        self.retriever = HistoryRetriever()
-        self.reranker = SearchReranker()
+        self.query_processor = get_query_processor()
+        self.retriever = get_retriever()
+        self.reranker = get_reranker()
         self.history_model = HistoryModel()
         
         # Time reference patterns
-        self.time_patterns = {
-            'today': 1,
-            'yesterday': 2,
-            'this week': 7,
-            'past week': 7,
-            'last week': 14,
-            'this month': 30,
-            'past month': 30,
-            'recent': 14,
-            'recently': 14,
-            'past few days': 5,
-            'last few days': 5
-        }
+        self.time_patterns = TIME_PATTERNS
         
     def build_context(self, query, top_k=None):
         """Build context for RAG by retrieving relevant chunks with better handling"""
@@ -50,21 +129,28 @@ class ContextBuilder:
         
         try:
             # 1. Process query with more detailed logging
-            query_data = self.query_processor.process_query(query)
+            # Normalized so trivially different queries share the processor's cache
+            query_data = self.query_processor.process_query(_normalize_query(query))
+            query_data['original_query'] = query
             logger.info(f"Processed query: cleaned='{query_data['cleaned_query']}', key_terms={query_data['key_terms']}, time_info={query_data['time_info']}")
             
-            # 2. Try direct lookup if query is about recent history
+            # 2. Try direct lookup if query is about recent history, with the
+            # vector search already running in case the lookup comes back empty
             context_chunks = []
             if self._is_activity_summary_query(query) and query_data.get('time_info'):
                 logger.info("Activity summary query detected, trying direct database lookup first")
+                search_future = _search_pool.submit(self.retriever.search, query_data, top_k * 2)
                 time_frame = self._extract_time_frame(query)
-                direct_chunks = self._get_activity_summary(time_frame or 14, query_data['key_terms'])
+                direct_chunks = self._get_activity_summary(time_frame or 14, query_data['key_terms'], top_k)
                 if direct_chunks:
                     logger.info(f"Direct database lookup found {len(direct_chunks)} chunks")
-                    return self._add_context_metadata(direct_chunks[:top_k], query)
+                    search_future.cancel()
+                    return self._add_context_metadata(direct_chunks, query, query_data['key_terms'])
+                results = search_future.result()
+            else:
+                results = self.retriever.search(query_data, top_k * 2)
             
             # 3. Vector search with fallback
-            results = self.retriever.search(query_data, top_k * 2)
             logger.info(f"Vector search found {len(results)} results")
             
             # Log sample results for debugging
@@ -74,20 +160,20 @@ class ContextBuilder:
             
             if not results:
                 logger.warning("No results from vector search, trying fallback")
-                fallback_chunks = self._get_fallback_context(query, query_data.get('time_info', None), top_k)
-                return self._add_context_metadata(fallback_chunks, query)
+                fallback_chunks = self._get_fallback_context(query, query_data.get('time_info', None), top_k, query_data['key_terms'])
+                return self._add_context_metadata(fallback_chunks, query, query_data['key_terms'])
             
             # 4. Ensure diversity in results
             diversified_results = self._ensure_diversity(results, top_k)
             logger.info(f"Diversified to {len(diversified_results)} results")
             
             # 5. Add metadata and return
-            context_chunks = self._add_context_metadata(diversified_results[:top_k], query)
+            context_chunks = self._add_context_metadata(diversified_results[:top_k], query, query_data['key_terms'])
             
             # 6. If we still have too few results, try fallback
             if len(context_chunks) < min(3, top_k):
                 logger.info("Insufficient vector search results, trying fallback")
-                fallback_chunks = self._get_fallback_context(query, query_data.get('time_info', None), top_k)
+                fallback_chunks = self._get_fallback_context(query, query_data.get('time_info', None), top_k, query_data['key_terms'])
                 if fallback_chunks:
                     # Combine with existing chunks
                     combined_chunks = context_chunks + fallback_chunks
@@ -105,14 +191,11 @@ class ContextBuilder:
     
     def _extract_time_frame(self, query):
         """Extract a time frame from the query in days"""
-        query_lower = query.lower()
-        
         # Check for explicit patterns like "in the last X days/weeks/months"
-        numeric_pattern = r'(?:in|the|last|past)\s+(\d+)\s+(day|days|week|weeks|month|months)'
-        match = re.search(numeric_pattern, query_lower)
+        match = TIME_FRAME_RE.search(query)
         if match:
             number = int(match.group(1))
-            unit = match.group(2)
+            unit = match.group(2).lower()
             
             if 'day' in unit:
                 return number
@@ -121,97 +204,73 @@ class ContextBuilder:
             elif 'month' in unit:
                 return number * 30
         
-        # Check for common time references
-        for phrase, days in self.time_patterns.items():
-            if phrase in query_lower:
-                return days
+        # Check for common time references, preferring the highest priority one mentioned
+        phrases = [m.group().lower() for m in TIME_PATTERN_RE.finditer(query)]
+        if phrases:
+            return TIME_PATTERNS[min(phrases, key=TIME_PATTERN_PRIORITY.__getitem__)]
         
         # Default: if the query seems time-based but no specific time is mentioned
-        if any(word in query_lower for word in ['recent', 'lately', 'been', 'interested']):
+        if TIME_HINT_RE.search(query):
             return 14  # Default to 2 weeks for time-based queries without specifics
             
         return None
     
     def _is_activity_summary_query(self, query):
         """Check if this is a query asking for activity summary"""
-        query_lower = query.lower()
-        
-        activity_terms = [
-            'what have i', 'been doing', 'looked at', 'searched for',
-            'browsing history', 'activity', 'visited', 'browsed',
-            'been reading', 'been researching', 'been interested in',
-            'topics', 'summary', 'overview'
-        ]
-        
-        return any(term in query_lower for term in activity_terms)
+        return ACTIVITY_TERMS_RE.search(query) is not None
     
-    def _get_activity_summary(self, days, keywords=None):
+    def _get_activity_summary(self, days, keywords=None, limit=None):
         """Get a summary of recent activity directly from the database"""
         try:
-            # Get recent history from database
-            recent_history = self.history_model.get_recent_history(50)  # Get more to filter
+            # Get history within the time frame from the database
+            cutoff = datetime.now() - timedelta(days=days)
+            recent_history = self.history_model.get_recent_history_since(cutoff, 50)
             
             if not recent_history:
                 return []
             
-            # Convert to usable format and filter by time
-            now = datetime.now()
-            cutoff = now - timedelta(days=days)
-            
-            chunks = []
-            for item in recent_history:
-                try:
-                    # Structure depends on your database schema, adjust as needed
-                    history_id = item[0] if len(item) > 0 else 0
-                    url = item[1] if len(item) > 1 else ''
-                    title = item[2] if len(item) > 2 else 'Untitled'
-                    visit_count = item[3] if len(item) > 3 else 1
-                    last_visit_time_str = item[4] if len(item) > 4 else None
-                    domain = item[5] if len(item) > 5 else urlparse(url).netloc if url else ''
-                    
-                    # Parse the timestamp and check if within time frame
-                    if last_visit_time_str:
-                        try:
-                            last_visit_time = datetime.fromisoformat(last_visit_time_str)
-                            if last_visit_time < cutoff:
-                                continue
-                        except (ValueError, TypeError):
-                            # If we can't parse the date, include it anyway
-                            pass
-                    
-                    # Create a chunk with relevant metadata
-                    chunk = {
-                        'history_id': history_id,
-                        'url': url,
-                        'title': title,
-                        'domain': domain,
-                        'visit_count': visit_count,
-                        'last_visit_time': last_visit_time_str,
-                        'chunk_text': f"Title: {title}\nURL: {url}\nDomain: {domain}\nVisited: {last_visit_time_str}\nVisit count: {visit_count}",
-                        'source_type': 'direct_query'
-                    }
-                    
-                    chunks.append(chunk)
-                except Exception as e:
-                    logger.warning(f"Error processing history item: {e}")
+            # Work on columns, only building chunks for the rows that survive
+            history_ids, urls, titles, visit_counts, visit_time_strs, domains = (
+                list(column) for column in zip(*recent_history)
+            )
+            rows = np.arange(len(recent_history))
             
             # Filter by keywords if provided
             if keywords:
-                filtered_chunks = []
-                for chunk in chunks:
-                    text = (chunk.get('title', '') + ' ' + chunk.get('url', '')).lower()
-                    if any(keyword.lower() in text for keyword in keywords):
-                        filtered_chunks.append(chunk)
+                keyword_re = re.compile('|'.join(re.escape(keyword.lower()) for keyword in keywords))
+                matches = np.array([
+                    keyword_re.search(f"{title or ''} {url or ''}".lower()) is not None
+                    for title, url in zip(titles, urls)
+                ], dtype=bool)
                 
-                # If we have enough keyword-filtered chunks, use those
-                if len(filtered_chunks) >= min(5, len(chunks) // 2):
-                    chunks = filtered_chunks
+                # If we have enough keyword-filtered rows, use those
+                if matches.sum() >= min(5, len(rows) // 2):
+                    rows = rows[matches]
             
-            # Sort by recency
-            chunks.sort(key=lambda x: (
-                x.get('last_visit_time', ''),
-                x.get('visit_count', 0)
-            ), reverse=True)
+            # Sort by recency, then visit count
+            visit_times = np.array(visit_time_strs, dtype='datetime64[s]')
+            visits = np.array([count or 0 for count in visit_counts])
+            rows = rows[np.lexsort((visits[rows], visit_times[rows]))[::-1]][:limit]
+            
+            chunks = []
+            for i in rows:
+                url = urls[i] or ''
+                title = titles[i]
+                domain = domains[i] or (urlparse(url).netloc if url else '')
+                last_visit_time_str = visit_time_strs[i]
+                visit_count = visit_counts[i]
+                
+                # Create a chunk with relevant metadata
+                chunks.append({
+                    'history_id': history_ids[i],
+                    'url': url,
+                    'title': title,
+                    'domain': domain,
+                    'visit_count': visit_count,
+                    'last_visit_time': last_visit_time_str,
+                    'chunk_text': f"Title: {title}\nURL: {url}\nDomain: {domain}\nVisited: {last_visit_time_str}\nVisit count: {visit_count}",
+                    'source_type': 'direct_query'
+                })
             
             return chunks
             
@@ -225,39 +284,37 @@ class ContextBuilder:
             return results
         
         # Group by domain
-        domain_groups = {}
+        domain_groups = defaultdict(list)
         for result in results:
-            domain = result.get('domain', '')
-            if domain not in domain_groups:
-                domain_groups[domain] = []
-            domain_groups[domain].append(result)
+            domain_groups[result.get('domain', '')].append(result)
         
         # Ensure we don't have too many from the same domain
         diversified = []
-        domains_added = {}
+        diversified_ids = set()  # identities of added results, for O(1) membership checks
+        domains_added = defaultdict(int)
         
         # First, add the top result from each domain
         for domain, group in sorted(domain_groups.items(), key=lambda x: len(x[1]), reverse=True):
-            if group:
-                # Add the best result from this domain
-                diversified.append(group[0])
-                domains_added[domain] = 1
-                # Remove it from the group
-                group.pop(0)
+            # Add the best result from this domain
+            diversified.append(group[0])
+            diversified_ids.add(id(group[0]))
+            domains_added[domain] = 1
+        
+        # Limit to 3 results per domain by default
+        max_per_domain = max(1, top_k // 5)
         
         # Then, add remaining results, limiting each domain
         for result in results:
             domain = result.get('domain', '')
             
             # Skip if this exact result is already added
-            if result in diversified:
+            if id(result) in diversified_ids:
                 continue
                 
-            # Limit to 3 results per domain by default
-            max_per_domain = max(1, top_k // 5)
-            if domains_added.get(domain, 0) < max_per_domain:
+            if domains_added[domain] < max_per_domain:
                 diversified.append(result)
-                domains_added[domain] = domains_added.get(domain, 0) + 1
+                diversified_ids.add(id(result))
+                domains_added[domain] += 1
                 
             # If we have enough diverse results, stop
             if len(diversified) >= top_k:
@@ -266,33 +323,35 @@ class ContextBuilder:
         # If we still need more, add any remaining
         if len(diversified) < min(top_k, len(results)):
             for result in results:
-                if result not in diversified:
+                if id(result) not in diversified_ids:
                     diversified.append(result)
+                    diversified_ids.add(id(result))
                     
                     if len(diversified) >= top_k:
                         break
         
         return diversified
     
-    def _add_context_metadata(self, chunks, query):
+    def _add_context_metadata(self, chunks, query, key_terms=None):
         """Add metadata about why each chunk was selected"""
-        keywords = self._extract_keywords(query)
+        keywords = self._extract_keywords(query, tokens=key_terms)
+        now = datetime.now()
         
         for chunk in chunks:
             relevance_notes = []
             
             # Note keyword matches
-            text = chunk.get('chunk_text', '').lower()
-            
-            matched_keywords = [k for k in keywords if k in text]
-            if matched_keywords:
-                relevance_notes.append(f"Matches keywords: {', '.join(matched_keywords)}")
+            if keywords:
+                text = chunk.get('chunk_text', '').lower()
+                matched_keywords = [k for k in keywords if k in text]
+                if matched_keywords:
+                    relevance_notes.append(f"Matches keywords: {', '.join(matched_keywords)}")
             
             # Note recency if available
-            if 'last_visit_time' in chunk:
+            if chunk.get('last_visit_time') is not None:
                 try:
-                    visit_time = datetime.fromisoformat(chunk['last_visit_time'])
-                    days_ago = (datetime.now() - visit_time).days
+                    visit_time = _parse_iso(chunk['last_visit_time'])
+                    days_ago = (now - visit_time).days
                     if days_ago == 0:
                         relevance_notes.append("Visited today")
                     elif days_ago == 1:
@@ -313,15 +372,15 @@ class ContextBuilder:
             
         return chunks
     
-    def _get_fallback_context(self, query, time_frame, limit):
+    def _get_fallback_context(self, query, time_frame, limit, key_terms=None):
         """Get fallback context when vector search fails"""
         # If it's an activity summary query, use direct query
         if self._is_activity_summary_query(query):
-            keywords = self._extract_keywords(query)
-            return self._get_activity_summary(time_frame or 14, keywords)[:limit]
+            keywords = self._extract_keywords(query, tokens=key_terms)
+            return self._get_activity_summary(time_frame or 14, keywords, limit)
         
         # For domain-specific queries
-        domain_match = re.search(r'(?:on|about|from|at)\s+([a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', query.lower())
+        domain_match = DOMAIN_RE.search(query.lower())
         if domain_match:
             domain = domain_match.group(1)
             return self._get_domain_specific_context(query, domain, limit)
@@ -361,7 +420,8 @@ class ContextBuilder:
     
     def _get_recent_chunks(self, limit, days=7):
         """Get recent chunks from the database"""
-        recent_history = self.history_model.get_recent_history(limit)
+        cutoff = datetime.now() - timedelta(days=days)
+        recent_history = self.history_model.get_recent_history_since(cutoff, limit)
         
         chunks = []
         for item in recent_history:
@@ -405,19 +465,36 @@ class ContextBuilder:
             return []
     
     def _deduplicate_chunks(self, chunks):
-        """Remove duplicate chunks based on URL or content"""
+        """Remove duplicate chunks based on URL or near-identical content"""
         if not chunks:
             return []
             
         unique_chunks = []
         seen_urls = set()
+        seen_hashes = set()
+        lsh = MinHashLSH(threshold=DUPLICATE_THRESHOLD, num_perm=DUPLICATE_NUM_PERM) if DATASKETCH_AVAILABLE else None
         
-        for chunk in chunks:
+        for i, chunk in enumerate(chunks):
             url = chunk.get('url', '')
             
             if url and url in seen_urls:
                 continue
                 
+            text = f"{chunk.get('title', '')} {url} {chunk.get('chunk_text', '')}"
+            if lsh is not None:
+                # Skip chunks that are near-duplicates of one already kept
+                minhash = text_minhash(text, DUPLICATE_NUM_PERM)
+                if lsh.query(minhash):
+                    continue
+                lsh.insert(str(i), minhash)
+            else:
+                # Without MinHash, only catch duplicates with the same normalized opening
+                normalized = ' '.join(text.lower().split())[:DUPLICATE_PREFIX_CHARS]
+                digest = hashlib.sha1(normalized.encode('utf-8')).digest()
+                if digest in seen_hashes:
+                    continue
+                seen_hashes.add(digest)
+                
             if url:
                 seen_urls.add(url)
                 
@@ -425,13 +502,11 @@ class ContextBuilder:
             
         return unique_chunks
             
-    def _extract_keywords(self, text):
-        """Extract keywords from text"""
-        # Remove stopwords
-        stopwords = {'a', 'an', 'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'with', 'about', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'}
-        words = text.lower().split()
-        keywords = [w for w in words if w not in stopwords and len(w) > 2]
-        return keywords
+    def _extract_keywords(self, text, tokens=None):
+        """Extract keywords from text, or from already lowercased tokens when given"""
+        if tokens is not None:
+            return [w for w in tokens if w not in KEYWORD_STOPWORDS and len(w) > 2]
+        return list(_keywords(text))
 
     def _contains_keywords(self, text, keywords):
         """Check if text contains any of the keywords"""
@@ -440,8 +515,10 @@ class ContextBuilder:
             
         # Check for at least half of the keywords
         min_matches = max(1, len(keywords) // 2)
+        if min_matches == 1:
+            return any(keyword in text for keyword in keywords)
+            
         matches = 0
-        
         for keyword in keywords:
             if keyword in text:
                 matches += 1
@@ -2,12 +2,19 @@
 """
 Generate responses using the LLM
 """
+import copy
 import torch
 import logging
+import threading
 from datetime import datetime
 
+from transformers import TextIteratorStreamer
+
+from src.config import PREFIX_CACHE_SIZE
 from src.llm.model_loader import ModelLoader
-from src.llm.cache import LLMCache
+from src.llm.cache import LLMCache, get_semantic_cache
+from src.llm.prompt_builder import IM_START_USER
+from src.database.models import query_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -20,34 +27,84 @@ class ResponseGenerator:
         self.model, self.tokenizer, self.generation_config = model_loader.load_model()
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.cache = LLMCache()
+        self.semantic_cache = get_semantic_cache()
+        self._prefix_cache, self._prefix_lock = model_loader.get_prefix_cache()
+        
+    @torch.inference_mode()
+    def _encode(self, prompt):
+        """Encode a prompt, returning its input ids and any cached KV for its prefix"""
+        # Prompts share a system + context block before the user turn; the KV cache
+        # for that block is computed once and reused for every prompt with the same prefix
+        prefix, boundary, suffix = prompt.rpartition(IM_START_USER)
+        if PREFIX_CACHE_SIZE <= 0 or not boundary:
+            return self.tokenizer.encode(prompt, return_tensors="pt").to(self.device), None
+            
+        # Encode the prefix on its own so its tokens line up with the cached KV
+        prefix_ids = self.tokenizer.encode(prefix, return_tensors="pt").to(self.device)
+        suffix_ids = self.tokenizer.encode(boundary + suffix, return_tensors="pt", add_special_tokens=False).to(self.device)
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+        
+        prefix_hash = query_fingerprint(prefix)
+        with self._prefix_lock:
+            past_key_values = self._prefix_cache.get(prefix_hash)
+            if past_key_values is not None:
+                self._prefix_cache.move_to_end(prefix_hash)
+                
+        if past_key_values is None:
+            # Prefill the shared prefix once
+            past_key_values = self.model(prefix_ids, use_cache=True).past_key_values
+            with self._prefix_lock:
+                self._prefix_cache[prefix_hash] = past_key_values
+                while len(self._prefix_cache) > PREFIX_CACHE_SIZE:
+                    self._prefix_cache.popitem(last=False)
+        else:
+            logger.info("Reusing cached prompt prefix")
+            
+        # generate() extends the cache in place, so hand it a copy
+        return input_ids, copy.deepcopy(past_key_values)
+        
+    def _generate(self, input_ids, past_key_values=None, streamer=None):
+        """Run model.generate, continuing from a cached prefix when one is given"""
+        kwargs = dict(self.generation_config)
+        if past_key_values is not None:
+            kwargs['past_key_values'] = past_key_values
+        if streamer is not None:
+            kwargs['streamer'] = streamer
+            
+        with torch.inference_mode():
+            return self.model.generate(input_ids, **kwargs)
+            
+    def _generate_into(self, streamer, input_ids, past_key_values, errors):
+        """Background generation for a streamer, ending the stream if generation fails"""
+        try:
+            self._generate(input_ids, past_key_values, streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
         
     def generate_response(self, prompt):
         """Generate a response using the LLM"""
         logger.info("Generating response")
         
         # Check cache first
-        cached_response = self.cache.get_cached_response(prompt)
+        cached_response = self.cache.get_cached_response(prompt) or self.semantic_cache.get_cached_response(prompt)
         if cached_response:
             logger.info("Using cached response")
             return cached_response
             
         try:
-            # Encode the prompt
-            input_ids = self.tokenizer.encode(prompt, return_tensors="pt").to(self.device)
+            # Encode the prompt, reusing the prefill of a previously seen prefix
+            input_ids, past_key_values = self._encode(prompt)
             
             # Generate response
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    input_ids,
-                    **self.generation_config
-                )
+            outputs = self._generate(input_ids, past_key_values)
                 
             # Decode the response, excluding the input prompt
             response = self.tokenizer.decode(outputs[0][input_ids.shape[1]:], skip_special_tokens=True)
             
-            # Cache the response
             # Cache the response
             self.cache.cache_response(prompt, response)
+            self.semantic_cache.cache_response(prompt, response)
             
             logger.info("Generated response")
             return response
@@ -98,15 +155,43 @@ class ResponseGenerator:
     #         yield "I'm sorry, I encountered an error while generating a response. Please try again."
 
     def generate_streaming_response(self, prompt):
-        """Generate a streaming response for better UI experience"""
+        """Generate a response, yielding text as the model produces it"""
         logger.info("Generating streaming response")
         
-        # For Unsloth, we need to handle streaming differently
-        # Instead of streaming directly, we'll just generate the full response
-        # and the StreamingResponse class will handle the simulated streaming
+        cached_response = self.cache.get_cached_response(prompt) or self.semantic_cache.get_cached_response(prompt)
+        if cached_response:
+            logger.info("Using cached response")
+            yield cached_response
+            return
+            
         try:
-            response = self.generate_response(prompt)
-            return response
+            input_ids, past_key_values = self._encode(prompt)
+            
+            # generate() runs in the background and pushes decoded text to the streamer
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            errors = []
+            thread = threading.Thread(
+                target=self._generate_into,
+                args=(streamer, input_ids, past_key_values, errors),
+                daemon=True
+            )
+            thread.start()
+            
+            pieces = []
+            for text in streamer:
+                if text:
+                    pieces.append(text)
+                    yield text
+            thread.join()
+            if errors:
+                raise errors[0]
+            
+            # Cache the full response
+            response = ''.join(pieces)
+            self.cache.cache_response(prompt, response)
+            self.semantic_cache.cache_response(prompt, response)
+            logger.info("Generated streaming response")
+            
         except Exception as e:
             logger.error(f"Error generating streaming response: {e}")
-            return "I'm sorry, I encountered an error while generating a response. Please try again."
+            yield "I'm sorry, I encountered an error while generating a response. Please try again."
@@ -4,17 +4,22 @@ Load and manage the Qwen3-4B model
 """
 import os
 import logging
+import threading
 import torch
+from collections import OrderedDict
 from pathlib import Path
 from unsloth import FastLanguageModel
 
 from src.config import (
     LLM_MODEL_NAME, LLM_CACHE_DIR, LLM_MAX_SEQ_LENGTH,
-    LORA_R, LORA_ALPHA
+    LORA_R, LORA_ALPHA, LLM_COMPILE_MODEL
 )
 
 logger = logging.getLogger(__name__)
 
+# torch.compile is only worth it (and only reliable) from Ampere onwards
+MIN_COMPILE_CAPABILITY = (8, 0)
+
 class ModelLoader:
     """Load and manage the Qwen3-4B model using Unsloth optimization"""
     
@@ -22,7 +27,12 @@ class ModelLoader:
     _model = None
     _tokenizer = None
     _generation_config = None
-    _is_loading = False
+    _load_lock = threading.Lock()
+    
+    # KV caches of shared prompt prefixes, kept for the process alongside the model
+    # they were computed with so every ResponseGenerator reuses them
+    _prefix_cache = OrderedDict()
+    _prefix_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
@@ -38,22 +48,25 @@ class ModelLoader:
             self.lora_alpha = LORA_ALPHA
             self.initialized = True
         
+    def get_prefix_cache(self):
+        """The process-wide prompt prefix KV cache and the lock guarding it"""
+        return self._prefix_cache, self._prefix_lock
+        
     def load_model(self):
         """Load the Qwen3-4B model using Unsloth optimization"""
         # If already loaded, return the model
         if self._model is not None and self._tokenizer is not None:
             return self._model, self._tokenizer, self._generation_config
             
-        # If currently loading (another thread), wait a bit and check again
-        if self._is_loading:
-            logger.info("Model is already being loaded by another request, waiting...")
-            import time
-            time.sleep(5)  # Wait 5 seconds and check again
-            return self.load_model()
+        # Only one thread loads; the others block here until it is done
+        with self._load_lock:
+            if self._model is not None and self._tokenizer is not None:
+                return self._model, self._tokenizer, self._generation_config
+            return self._load()
             
+    def _load(self):
+        """Load the model, tokenizer and generation config into the class"""
         try:
-            # Mark as loading
-            self.__class__._is_loading = True
             logger.info(f"Loading model: {self.model_name}")
             
             # Determine device and data type
@@ -95,6 +108,17 @@ class ModelLoader:
                 bias="none",
             )
             
+            # Switch to inference mode (no dropout, Unsloth's fused generation kernels)
+            FastLanguageModel.for_inference(model)
+            
+            # Compile the forward pass to cut per-token Python overhead while decoding
+            if LLM_COMPILE_MODEL:
+                if torch.cuda.is_available() and torch.cuda.get_device_capability() >= MIN_COMPILE_CAPABILITY:
+                    logger.info("Compiling model forward pass")
+                    model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+                else:
+                    logger.info("Skipping torch.compile, needs CUDA compute capability 8.0+")
+            
             # Store in class variables
             self.__class__._model = model
             self.__class__._tokenizer = tokenizer
@@ -105,7 +129,4 @@ class ModelLoader:
             
         except Exception as e:
             logger.error(f"Error loading model: {e}")
-            raise
-        finally:
-            # Mark as no longer loading
-            self.__class__._is_loading = False
\ No newline at end of file
+            raise
\ No newline at end of file
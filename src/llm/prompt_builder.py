@@ -4,21 +4,154 @@ Build prompts for the LLM
 """
 from __future__ import annotations
 
+import hashlib
+import heapq
 import logging
 import re
+import sys
+from collections import Counter
+from functools import lru_cache
+from operator import itemgetter
+from typing import ClassVar, Iterator
 from urllib.parse import urlparse
 
 from src.config import SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 
+# Title clean-up patterns, compiled once since every history item's title goes through them
+CLOUDFLARE_RE = re.compile(r"verify (you are|you're) human", re.I)
+# logger.*("…") artefacts and search-engine suffixes, removed in a single pass
+TITLE_NOISE_RE = re.compile(
+    r'logger\.\w+\([\'"].*?[\'"]\)'
+    r"|\s*[-|–]\s*(?:Google|Google Search|Bing|Yahoo!?)\s*Search?.*$",
+    re.I,
+)
+# Many titles are cleaned at once by joining them with a separator that is not
+# whitespace; the batch pattern never matches across it
+TITLE_SEPARATOR = "\x00"
+TITLE_NOISE_BATCH_RE = re.compile(
+    r'logger\.\w+\([\'"][^\x00\n]*?[\'"]\)'
+    r"|\s*[-|–]\s*(?:Google|Google Search|Bing|Yahoo!?)\s*Search?[^\x00\n]*(?=\x00|\Z)",
+    re.I,
+)
+
+# Context chunks kept in retrieval order; the rest are ordered by URL so that
+# reshuffled low-relevance results still produce the same prompt text
+FRESH_CONTEXT_CHUNKS = 3
+
+# Size budget for the history block of a summary prompt (roughly 4 characters per token)
+SUMMARY_MAX_CHARS = 16000
+
+# Qwen chat control tokens, interned so every prompt shares the same objects
+IM_START_SYSTEM = sys.intern("<|im_start|>system\n")
+IM_START_USER = sys.intern("<|im_start|>user\n")
+IM_START_ASSISTANT = sys.intern("<|im_start|>assistant\n")
+IM_END = sys.intern("\n<|im_end|>\n\n")
+
+# Qwen chat scaffolding, filled in with str.format_map. The system prompt is a
+# turn of its own so every prompt opens with the same bytes, and the browsing
+# history follows in a user turn, keeping the shared prefix reusable by KV caches
+SYSTEM_TURN = IM_START_SYSTEM + "{system}" + IM_END
+CONTEXT_ACK_TURN = IM_START_ASSISTANT + "Acknowledged." + IM_END
+CHAT_TEMPLATE = (
+    SYSTEM_TURN
+    + IM_START_USER
+    + "Here is the relevant information from my browsing history:\n\n{context}"
+    + IM_END
+    + CONTEXT_ACK_TURN
+    + IM_START_USER
+    + "{user}"
+    + IM_END
+    + IM_START_ASSISTANT
+)
+# Chat turns without any retrieved context skip the history turn entirely
+NO_CONTEXT_CHAT_TEMPLATE = SYSTEM_TURN + IM_START_USER + "{user}" + IM_END + IM_START_ASSISTANT
+# Split around the context so the chat prompt can be produced in fragments
+CHAT_HEAD, _, CHAT_TAIL = CHAT_TEMPLATE.partition("{context}")
+SUMMARY_TEMPLATE = (
+    SYSTEM_TURN
+    + IM_START_USER
+    + "I need you to analyse and summarise the following {period} browsing history:\n\n{history}"
+    + IM_END
+    + CONTEXT_ACK_TURN
+    + IM_START_USER
+    + "Please give me a concise summary of my recent browsing activity. "
+    "What topics have I been focusing on? Any patterns or trends?"
+    + IM_END
+    + IM_START_ASSISTANT
+)
+DOMAIN_ANALYSIS_TEMPLATE = (
+    SYSTEM_TURN
+    + IM_START_USER
+    + "I need you to analyse my browsing activity on {domain}:\n\n{history}"
+    + IM_END
+    + CONTEXT_ACK_TURN
+    + IM_START_USER
+    + "What have I been looking at on {domain}? Any topics or patterns stand out?"
+    + IM_END
+    + IM_START_ASSISTANT
+)
+
+
+@lru_cache(maxsize=8)
+def _chat_head(system: str) -> str:
+    """Chat prompt up to the retrieved context, formatted once per system prompt."""
+    return CHAT_HEAD.format_map({"system": system})
+
+
+def _may_have_noise(lowered: str) -> bool:
+    """Cheap check for anything TITLE_NOISE_RE could remove from a lowercased title."""
+    return "logger" in lowered or "-" in lowered or "|" in lowered or "–" in lowered
+
+
+@lru_cache(maxsize=4096)
+def _clean_title_cached(raw: str) -> str:
+    """Clean a non-empty title; memoized since the same titles recur throughout a history."""
+    # Cloudflare human‑verification pages
+    lowered = raw.lower()
+    if "verify" in lowered and CLOUDFLARE_RE.search(raw):
+        return "[cloudflare challenge]"
+
+    # logger.*("…") artefacts and search‑engine suffixes
+    title = raw.strip()
+    if _may_have_noise(lowered):
+        title = TITLE_NOISE_RE.sub("", title)
+
+    # Collapse whitespace
+    return " ".join(title.split()) or "Untitled"
+
+
+def _clean_titles(raw_titles: list[str | None]) -> list[str]:
+    """Clean many titles with one regex pass over all of them joined together."""
+    cleaned = [None] * len(raw_titles)
+    batch_indexes, batch = [], []
+    for i, raw in enumerate(raw_titles):
+        if not raw:
+            cleaned[i] = "Untitled"
+            continue
+        lowered = raw.lower()
+        if TITLE_SEPARATOR in raw or "verify" in lowered:
+            # Possible Cloudflare pages (and titles that would break the join) go one by one
+            cleaned[i] = _clean_title_cached(raw)
+        elif _may_have_noise(lowered):
+            batch_indexes.append(i)
+            batch.append(raw.strip())
+        else:
+            cleaned[i] = " ".join(raw.split()) or "Untitled"
+
+    if batch:
+        blob = TITLE_NOISE_BATCH_RE.sub("", TITLE_SEPARATOR.join(batch))
+        for i, title in zip(batch_indexes, blob.split(TITLE_SEPARATOR)):
+            cleaned[i] = " ".join(title.split()) or "Untitled"
+    return cleaned
+
 
 class PromptBuilder:
     """Build prompts for the LLM"""
 
-    # ────────────────────────────────────────────────────────────────────────
-    def __init__(self) -> None:
-        self.system_prompt = SYSTEM_PROMPT
+    # Shared by every instance; subclasses can override it
+    system_prompt: ClassVar[str] = SYSTEM_PROMPT
 
     # ────────────────────────────────────────────────────────────────────────
     # Helpers
@@ -34,108 +167,99 @@ class PromptBuilder:
         if not raw:
             return "Untitled"
 
-        title = raw.strip()
-
-        # logger.*("…") artefacts
-        title = re.sub(r'logger\.\w+\([\'"].*?[\'"]\)', '', title, flags=re.I)
-
-        # Cloudflare human‑verification pages
-        if re.search(r"verify (you are|you're) human", title, flags=re.I):
-            return "[cloudflare challenge]"
-
-        # Search‑engine suffixes
-        title = re.sub(r"\s*[-|–]\s*(Google|Google Search|Bing|Yahoo!?)\s*Search?.*$", "", title, flags=re.I)
-
-        # Collapse whitespace
-        title = re.sub(r"\s+", " ", title).strip()
-
-        return title or "Untitled"
+        return _clean_title_cached(raw)
 
     # ────────────────────────────────────────────────────────────────────────
     # Prompt builders
     # ────────────────────────────────────────────────────────────────────────
     def build_chat_prompt(self, user_query: str, context_chunks: list[dict]) -> str:
         """Prompt for RAG chat."""
+        if not context_chunks:
+            logger.info("Building chat prompt without context")
+            return NO_CONTEXT_CHAT_TEMPLATE.format_map({"system": self.system_prompt, "user": user_query})
+        return "".join(self.iter_build_chat_prompt(user_query, context_chunks))
+
+    def iter_build_chat_prompt(self, user_query: str, context_chunks: list[dict]) -> Iterator[str]:
+        """Yield the RAG chat prompt in fragments, without materialising the whole string."""
+        if not context_chunks:
+            yield self.build_chat_prompt(user_query, context_chunks)
+            return
+
         logger.info("Building chat prompt with %d context chunks", len(context_chunks))
 
-        parts = []
+        tail = sorted(context_chunks[FRESH_CONTEXT_CHUNKS:], key=lambda c: str(c.get("url", "")))
+        context_chunks = context_chunks[:FRESH_CONTEXT_CHUNKS] + tail
+        if tail and logger.isEnabledFor(logging.DEBUG):
+            tail_urls = "\n".join(str(c.get("url", "")) for c in tail)
+            logger.debug("Context tail version %s", hashlib.blake2b(tail_urls.encode("utf-8"), digest_size=8).hexdigest())
+
+        yield _chat_head(self.system_prompt)
         for i, chunk in enumerate(context_chunks):
-            src = f"[{i + 1}] Source: {chunk['url']}"
+            if i:
+                yield "\n\n"
+            yield from ("[", str(i + 1), "] Source: ", str(chunk["url"]))
             if "domain" in chunk:
-                src += f" (Domain: {chunk['domain']})"
-            parts.append(f"{src}\nContent: {chunk['chunk_text']}")
-
-        context = "\n\n".join(parts)
-
-        prompt = (
-            "<|im_start|>system\n"
-            f"{self.system_prompt}\n\n"
-            "I have access to the following information from your browsing history:\n\n"
-            f"{context}\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>user\n"
-            f"{user_query}\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>assistant\n"
-        )
-        return prompt
+                yield from (" (Domain: ", str(chunk["domain"]), ")")
+            yield from ("\nContent: ", str(chunk["chunk_text"]))
+        yield CHAT_TAIL.format_map({"user": user_query})
 
-    def build_summary_prompt(self, history_data: list[dict], period: str = "recent") -> str:
+    def build_summary_prompt(
+        self, history_data: list[dict], period: str = "recent", max_chars: int = SUMMARY_MAX_CHARS
+    ) -> str:
         """Prompt for summarising browsing history (clean titles!)."""
         logger.info("Building summary prompt for %s history", period)
 
-        lines = []
-        for item in history_data:
-            title = self._clean_title(item.get("title"))
-            visited = item.get("last_visit_time", "unknown")
-            lines.append(f"- Visited: {visited}\n  Title: {title}")
-
-        history_text = "\n".join(lines[:200])  # cap length
-
-        prompt = (
-            "<|im_start|>system\n"
-            f"{self.system_prompt}\n\n"
-            f"I need you to analyse and summarise the following {period} browsing history:\n\n"
-            f"{history_text}\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>user\n"
-            "Please give me a concise summary of my recent browsing activity. "
-            "What topics have I been focusing on? Any patterns or trends?\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>assistant\n"
-        )
-        return prompt
+        # Pull the fields out once, newest visits first so the budget keeps the most recent activity
+        records = [(item.get("last_visit_time") or "", item.get("title")) for item in history_data]
+        records.sort(key=itemgetter(0), reverse=True)
+        titles = _clean_titles([raw_title for _, raw_title in records])
+
+        # Accumulate UTF-8 bytes and decode once, stopping at the size budget (cap length)
+        buf = bytearray()
+        for (visited, _), title in zip(records, titles):
+            line = f"- Visited: {visited or 'unknown'}\n  Title: {title}".encode("utf-8")
+            if buf:
+                if len(buf) + 1 + len(line) > max_chars:
+                    break
+                buf += b"\n"
+            buf += line
+
+        history_text = buf.decode("utf-8")
+
+        return SUMMARY_TEMPLATE.format_map({
+            "system": self.system_prompt,
+            "period": period,
+            "history": history_text,
+        })
 
     def build_domain_analysis_prompt(self, domain: str, history_data: list[dict]) -> str:
         """Prompt for analysing activity on a single domain (clean titles!)."""
         logger.info("Building domain analysis prompt for %s", domain)
 
-        domain_items_text = []
-        for item in history_data:
-            if item.get("domain") != domain:
-                continue
-            title = self._clean_title(item.get("title"))
-            visited = item.get("last_visit_time", "unknown")
-            domain_items_text.append(f"- Visited: {visited}\n  Title: {title}")
-
-        history_text = "\n".join(domain_items_text)
-
-        prompt = (
-            "<|im_start|>system\n"
-            f"{self.system_prompt}\n\n"
-            f"I need you to analyse my browsing activity on {domain}:\n\n"
-            f"{history_text}\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>user\n"
-            f"What have I been looking at on {domain}? Any topics or patterns stand out?\n"
-            "<|im_end|>\n\n"
-            "<|im_start|>assistant\n"
+        items = [item for item in history_data if item.get("domain") == domain]
+        titles = _clean_titles([item.get("title") for item in items])
+        history_text = "\n".join(
+            f"- Visited: {item.get('last_visit_time', 'unknown')}\n  Title: {title}"
+            for item, title in zip(items, titles)
         )
-        return prompt
+
+        return DOMAIN_ANALYSIS_TEMPLATE.format_map({
+            "system": self.system_prompt,
+            "domain": domain,
+            "history": history_text,
+        })
 
 
     # Add these methods to your prompt_builder.py file
 
+    @staticmethod
+    def _history_lines(history_data):
+        """One "- time: title (domain)" line per history item"""
+        return (
+            f"- {item.get('last_visit_time', '')}: {item.get('title', '')} ({item.get('domain', '')})\n"
+            for item in history_data
+        )
+
     def build_period_summary_prompt(self, start_date, end_date, history_data):
         """Build a prompt for generating a summary of browsing activity for a time period"""
         total_items = len(history_data)
@@ -159,28 +283,23 @@ class PromptBuilder:
         sample_size = min(50, len(history_data))
         sample = history_data[:sample_size]
         
-        for item in sample:
-            prompt += f"- {item.get('last_visit_time', '')}: {item.get('title', '')} ({item.get('domain', '')})\n"
+        parts = [prompt]
+        parts.extend(self._history_lines(sample))
         
         # Add instruction to keep response concise
-        prompt += "\nProvide your analysis in a concise, informative format. Focus on meaningful patterns and insights."
+        parts.append("\nProvide your analysis in a concise, informative format. Focus on meaningful patterns and insights.")
         
-        return prompt
+        return "".join(parts)
 
     def build_period_analysis_prompt(self, start_date, end_date, history_data):
         """Build a prompt for generating a detailed analysis of browsing activity for a time period"""
         total_items = len(history_data)
         
         # Calculate domain frequencies
-        domain_counts = {}
-        for item in history_data:
-            domain = item.get('domain', '')
-            if domain:
-                domain_counts[domain] = domain_counts.get(domain, 0) + 1
+        domain_counts = Counter(item.get('domain', '') for item in history_data if item.get('domain', ''))
         
-        # Sort domains by frequency
-        sorted_domains = sorted(domain_counts.items(), key=lambda x: x[1], reverse=True)
-        top_domains = sorted_domains[:10]
+        # Top domains by frequency, ties in alphabetical order whatever order the history is in
+        top_domains = heapq.nsmallest(10, domain_counts.items(), key=lambda x: (-x[1], x[0]))
         
         domain_summary = "\n".join([f"- {domain}: {count} visits" for domain, count in top_domains])
         
@@ -220,12 +339,11 @@ class PromptBuilder:
         sample_size = min(100, len(history_data))
         sample = history_data[:sample_size]
         
-        for item in sample:
-            prompt += f"- {item.get('last_visit_time', '')}: {item.get('title', '')} ({item.get('domain', '')})\n"
+        parts = [prompt]
+        parts.extend(self._history_lines(sample))
+        parts.append("\nProvide your detailed analysis in a well-structured, easily readable format.")
         
-        prompt += "\nProvide your detailed analysis in a well-structured, easily readable format."
-        
-        return prompt
+        return "".join(parts)
 
     def build_date_chat_prompt(self, date, query, history_data):
         """Build a prompt for chatting about browsing activity on a specific date"""
@@ -239,9 +357,8 @@ class PromptBuilder:
     """
         
         # Add the history data
-        for item in history_data:
-            prompt += f"- {item.get('last_visit_time', '')}: {item.get('title', '')} ({item.get('domain', '')})\n"
-        
-        prompt += "\nRespond to their question in a helpful, conversational way, focusing on their browsing data from this date."
+        parts = [prompt]
+        parts.extend(self._history_lines(history_data))
+        parts.append("\nRespond to their question in a helpful, conversational way, focusing on their browsing data from this date.")
         
-        return prompt
\ No newline at end of file
+        return "".join(parts)
\ No newline at end of file
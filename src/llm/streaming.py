@@ -69,64 +69,40 @@
 Handle streaming responses for the chat interface
 """
 import logging
-import threading
-import queue
-import time
+import re
 from flask import Response
 
 logger = logging.getLogger(__name__)
 
+# Line breaks end an SSE field, so text containing them is sent as several data: lines
+SSE_LINE_BREAK_RE = re.compile(r'\r\n|\r|\n')
+
+def sse_event(text):
+    """Format text as one SSE message event; EventSource joins its data: lines with newlines"""
+    return ''.join(f"data: {line}\n" for line in SSE_LINE_BREAK_RE.split(text)) + "\n"
+
 class StreamingResponse:
     """Handle streaming responses for the chat interface"""
     
     def __init__(self, generator, prompt):
         self.generator = generator
         self.prompt = prompt
-        self.response_queue = queue.Queue()
-        self.thread = None
-        
-    def start_generation(self):
-        """Start generating the response in a separate thread"""
-        self.thread = threading.Thread(target=self._generate)
-        self.thread.daemon = True
-        self.thread.start()
-        
-    def _generate(self):
-        """Generate the response and put tokens in queue"""
-        try:
-            # Use non-streaming generation as a fallback
-            response = self.generator.generate_response(self.prompt)
-            
-            # Add response to queue character by character to simulate streaming
-            for char in response:
-                self.response_queue.put(char)
-                time.sleep(0.01)  # Small delay to simulate typing
-                
-            # Mark end of generation
-            self.response_queue.put(None)
-            
-        except Exception as e:
-            logger.error(f"Error in streaming generation: {e}")
-            error_msg = "I encountered an error while generating the response."
-            for char in error_msg:
-                self.response_queue.put(char)
-            self.response_queue.put(None)
             
     def get_flask_response(self):
         """Get a Flask response for streaming"""
         def generate():
-            while True:
-                # Get the next token
-                token = self.response_queue.get()
-                
-                # If None, end of generation
-                if token is None:
-                    break
+            # Text is sent as the model produces it; the generator already
+            # runs the model in the background, so no thread or queue is needed here
+            try:
+                for token in self.generator.generate_streaming_response(self.prompt):
+                    # Send the token as an SSE event
+                    yield sse_event(token)
                     
-                # Send the token as an SSE event
-                yield f"data: {token}\n\n"
+            except Exception as e:
+                logger.error(f"Error in streaming generation: {e}")
+                yield sse_event("I encountered an error while generating the response.")
                 
             # Send end event
-            yield "data: [END]\n\n"
+            yield sse_event("[END]")
             
-        return Response(generate(), mimetype="text/event-stream")
\ No newline at end of file
+        return Response(generate(), mimetype="text/event-stream")
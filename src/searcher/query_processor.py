@@ -4,33 +4,128 @@ Enhanced query processor for better search results
 """
 import re
 import logging
-import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 import nltk
-nltk.download('punkt_tab')
-from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 
 from src.indexer.embedder import TextEmbedder
+from src.database.models import query_fingerprint
 
 logger = logging.getLogger(__name__)
 
+# Try to import hyperscan - without it time references are matched with re
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    logger.warning("hyperscan not available, matching time references with re. Install with 'pip install hyperscan'")
+    HYPERSCAN_AVAILABLE = False
+
+# Number of processed queries kept. Results only depend on the query text and the
+# configured embedding model, so the cache is shared by every QueryProcessor
+QUERY_CACHE_SIZE = 256
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+# Maps ASCII characters that are neither word characters nor whitespace to spaces
+PUNCT_TABLE = str.maketrans({
+    c: ' ' for c in map(chr, range(128)) if not (c.isalnum() or c == '_' or c.isspace())
+})
+# Fallback for non-ASCII queries, where punctuation is not limited to the table above
+PUNCT_RE = re.compile(r'[^\w\s]')
+# Words of a cleaned query, which only has word characters and single spaces left
+TOKEN_RE = re.compile(r'\w+')
+
+# Detailed time patterns for better detection, in priority order
+TIME_REFERENCE_PATTERNS = [
+    ('today', r'\btoday\b|\btonight\b|\bcurrently\b'),
+    ('yesterday', r'\byesterday\b'),
+    ('this_week', r'\bthis week\b|\bpast week\b|\bcurrent week\b|\blast 7 days\b'),
+    ('last_week', r'\blast week\b|\bprevious week\b|\b1 week ago\b'),
+    ('this_month', r'\bthis month\b|\bcurrent month\b|\blast 30 days\b'),
+    ('last_month', r'\blast month\b|\bprevious month\b|\b1 month ago\b'),
+    ('this_year', r'\bthis year\b|\bcurrent year\b|\b2025\b'),  # Include current year
+    ('recent', r'\brecent\b|\brecently\b|\blately\b|\bpast few days\b'),
+]
+TIME_REFERENCE_PRIORITY = {time_type: i for i, (time_type, _) in enumerate(TIME_REFERENCE_PATTERNS)}
+# One named group per time type so a single scan finds every bucket mentioned
+TIME_REFERENCE_RE = re.compile(
+    '|'.join(f'(?P<{time_type}>{pattern})' for time_type, pattern in TIME_REFERENCE_PATTERNS)
+)
+
+def _build_time_reference_db():
+    """Compile the time patterns into one hyperscan database, ids in priority order"""
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[pattern.encode('utf-8') for _, pattern in TIME_REFERENCE_PATTERNS],
+            ids=list(range(len(TIME_REFERENCE_PATTERNS))),
+            elements=len(TIME_REFERENCE_PATTERNS),
+            flags=[hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP] * len(TIME_REFERENCE_PATTERNS)
+        )
+        return db
+    except hyperscan.error as e:
+        logger.warning(f"Could not compile time patterns with hyperscan, using re: {e}")
+        return None
+
+# Every time pattern matched in one linear pass; scans share scratch space so they're serialized
+_time_reference_db = _build_time_reference_db() if HYPERSCAN_AVAILABLE else None
+_time_reference_lock = threading.Lock()
+
+def _time_reference_types(text):
+    """Time types whose patterns occur anywhere in text"""
+    if _time_reference_db is None:
+        return {m.lastgroup for m in TIME_REFERENCE_RE.finditer(text)}
+        
+    ids = set()
+    with _time_reference_lock:
+        _time_reference_db.scan(text.encode('utf-8'), match_event_handler=lambda pattern_id, *_: ids.add(pattern_id))
+    return {TIME_REFERENCE_PATTERNS[i][0] for i in ids}
+
+# Specific day references (2-30 days ago)
+DAYS_AGO_RE = re.compile(r'(\d+)\s+days?\s+ago')
+# Implicit time references like "what have I been researching" or "what topics"
+IMPLICIT_TIME_RE = re.compile(
+    r'what have i been|what did i|what was i|show me what i|topics i|websites i'
+)
+
+@lru_cache(maxsize=None)
+def _english_stopwords():
+    """NLTK's English stopwords, loaded once and shared by every QueryProcessor"""
+    # Download NLTK data if needed
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+    return frozenset(stopwords.words('english'))
+
 class QueryProcessor:
     """Process search queries with advanced NLP techniques"""
     
     def __init__(self):
         self.embedder = TextEmbedder()
-        # Download NLTK data if needed
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt')
-        try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords')
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = _english_stopwords()
         
     def process_query(self, query_text):
+        """Process a search query and convert to embedding, reusing results for repeated queries"""
+        with _query_cache_lock:
+            query_data = _query_cache.get(query_text)
+            if query_data is not None:
+                _query_cache.move_to_end(query_text)
+                
+        if query_data is None:
+            query_data = self._process_query(query_text)
+            with _query_cache_lock:
+                _query_cache[query_text] = query_data
+                if len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        
+        # Copy so callers can't mutate the cached result
+        return dict(query_data, key_terms=list(query_data['key_terms']))
+        
+    def _process_query(self, query_text):
         """Process a search query and convert to embedding"""
         logger.info(f"Processing query: {query_text}")
         
@@ -60,56 +155,40 @@ class QueryProcessor:
         query = query_text.lower()
         
         # Remove punctuation
-        query = re.sub(r'[^\w\s]', ' ', query)
-        
-        # Replace multiple spaces with single space
-        query = re.sub(r'\s+', ' ', query)
+        if query.isascii():
+            query = query.translate(PUNCT_TABLE)
+        else:
+            query = PUNCT_RE.sub(' ', query)
         
-        return query.strip()
+        # Collapse whitespace and strip in one pass
+        return ' '.join(query.split())
         
     def _extract_time_references(self, query_text):
         """Extract time references from the query"""
         query_lower = query_text.lower()
         
-        # Detailed time patterns for better detection
-        time_patterns = {
-            r'\btoday\b|\btonight\b|\bcurrently\b': 'today',
-            r'\byesterday\b': 'yesterday',
-            r'\bthis week\b|\bpast week\b|\bcurrent week\b|\blast 7 days\b': 'this_week',
-            r'\blast week\b|\bprevious week\b|\b1 week ago\b': 'last_week',
-            r'\bthis month\b|\bcurrent month\b|\blast 30 days\b': 'this_month',
-            r'\blast month\b|\bprevious month\b|\b1 month ago\b': 'last_month',
-            r'\bthis year\b|\bcurrent year\b|\b2025\b': 'this_year',  # Include current year
-            r'\brecent\b|\brecently\b|\blately\b|\bpast few days\b': 'recent'
-        }
-        
         # Look for specific day references (2-30 days ago)
-        day_match = re.search(r'(\d+)\s+days?\s+ago', query_lower)
+        day_match = DAYS_AGO_RE.search(query_lower)
         if day_match:
             days = int(day_match.group(1))
             if days >= 1 and days <= 365:  # Reasonable range
                 return {'type': 'days_ago', 'value': days}
                 
-        # Look for patterns
-        for pattern, time_type in time_patterns.items():
-            if re.search(pattern, query_lower):
-                return {'type': time_type}
+        # Look for patterns, preferring the highest-priority type when several appear
+        time_types = _time_reference_types(query_lower)
+        if time_types:
+            return {'type': min(time_types, key=TIME_REFERENCE_PRIORITY.__getitem__)}
                 
-        # Check for implicit time references like "what have I been researching" or "what topics"
-        implicit_patterns = [
-            r'what have i been', r'what did i', r'what was i', 
-            r'show me what i', r'topics i', r'websites i'
-        ]
-        for pattern in implicit_patterns:
-            if re.search(pattern, query_lower):
-                return {'type': 'recent'}
+        # Check for implicit time references
+        if IMPLICIT_TIME_RE.search(query_lower):
+            return {'type': 'recent'}
                 
         return None
         
     def _extract_key_terms(self, query_text):
         """Extract key terms from the query for filtering"""
         # Tokenize
-        tokens = word_tokenize(query_text)
+        tokens = TOKEN_RE.findall(query_text)
         
         # Remove stopwords
         key_terms = [word for word in tokens if word not in self.stop_words and len(word) > 2]
@@ -118,4 +197,4 @@ class QueryProcessor:
         
     def get_query_hash(self, query_text):
         """Generate a hash for caching query results"""
-        return hashlib.md5(query_text.encode()).hexdigest()
\ No newline at end of file
+        return query_fingerprint(query_text)
\ No newline at end of file
@@ -89,13 +89,29 @@
 Enhanced reranker for search results
 """
 import logging
+import threading
 import numpy as np
+from datetime import datetime
+from collections import Counter, OrderedDict
 from sentence_transformers import CrossEncoder
 
 from src.config import RERANK_MODEL, USE_RERANKING
+from src.utils.text_utils import KEYWORD_STOPWORDS
+from src.utils.time_utils import age_in_days, visit_times
 
 logger = logging.getLogger(__name__)
 
+# (score, weight, default) combined into final_score, with and without the cross-encoder
+MODEL_SCORE_WEIGHTS = (('rerank_score', 0.5, 0.5), ('keyword_score', 0.3, 0.0), ('freshness_score', 0.2, 0.0))
+BASIC_SCORE_WEIGHTS = (('keyword_score', 0.5, 0.0), ('freshness_score', 0.5, 0.0))
+
+# Largest number of query/chunk pairs scored in one cross-encoder forward pass
+RERANK_BATCH_SIZE = 64
+
+# Number of (query, chunk) scores remembered, so paging through or repeating a
+# search doesn't run the cross-encoder on the same pairs again
+RERANK_CACHE_SIZE = 2048
+
 class SearchReranker:
     """Rerank search results with sophisticated relevance scoring"""
     
@@ -103,6 +119,8 @@ class SearchReranker:
         self.use_reranking = USE_RERANKING
         self.model_name = RERANK_MODEL
         self.model = None
+        self._score_cache = OrderedDict()
+        self._score_lock = threading.Lock()
         
         if self.use_reranking:
             self._load_model()
@@ -124,16 +142,14 @@ class SearchReranker:
         try:
             # Prepare pairs for reranking
             pairs = [(query, result['chunk_text']) for result in results]
-            
-            # Score the pairs
-            scores = self.model.predict(pairs)
+            scores = self._score_pairs(pairs)
             
             # Update the scores
-            for i, result in enumerate(results):
-                result['rerank_score'] = float(scores[i])
+            for result, score in zip(results, scores.tolist()):
+                result['rerank_score'] = score
                 
-            # Sort by rerank score (higher is better)
-            reranked_results = sorted(results, key=lambda x: x['rerank_score'], reverse=True)
+            # Sort by rerank score (higher is better), keeping ties in their original order
+            reranked_results = [results[i] for i in np.argsort(-scores, kind='stable')]
             
             logger.info(f"Reranked {len(reranked_results)} results")
             return reranked_results
@@ -142,6 +158,32 @@ class SearchReranker:
             logger.error(f"Error reranking results: {e}")
             return results
             
+    def _score_pairs(self, pairs):
+        """Cross-encoder scores for the pairs, only running the model on pairs not scored recently"""
+        with self._score_lock:
+            scores = [self._score_cache.get(pair) for pair in pairs]
+            for pair, score in zip(pairs, scores):
+                if score is not None:
+                    self._score_cache.move_to_end(pair)
+                    
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            # Score the new pairs in as few batches as possible
+            new_scores = self.model.predict(
+                [pairs[i] for i in missing],
+                batch_size=min(RERANK_BATCH_SIZE, len(missing)),
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            with self._score_lock:
+                for i, score in zip(missing, new_scores.tolist()):
+                    scores[i] = score
+                    self._score_cache[pairs[i]] = score
+                while len(self._score_cache) > RERANK_CACHE_SIZE:
+                    self._score_cache.popitem(last=False)
+                    
+        return np.array(scores)
+            
     def filter_and_rerank(self, results, query):
         """Filter and rerank results with improved scoring"""
         if not results:
@@ -173,22 +215,8 @@ class SearchReranker:
                     if 'rerank_score' not in result:
                         result['rerank_score'] = 0.5  # Default score
                         
-                # Calculate final score
-                for result in model_reranked:
-                    # Weight the different factors
-                    model_weight = 0.5
-                    keyword_weight = 0.3
-                    freshness_weight = 0.2
-                    
-                    # Calculate combined score
-                    result['final_score'] = (
-                        (result.get('rerank_score', 0.5) * model_weight) +
-                        (result.get('keyword_score', 0.0) * keyword_weight) +
-                        (result.get('freshness_score', 0.0) * freshness_weight)
-                    )
-                    
-                # Sort by final score
-                filtered_results = sorted(model_reranked, key=lambda x: x.get('final_score', 0.0), reverse=True)
+                # Weight the model, keyword and freshness scores and sort by the result
+                filtered_results = self._rank(model_reranked, MODEL_SCORE_WEIGHTS)
             except Exception as e:
                 logger.error(f"Error in model reranking: {e}")
                 # Fall back to basic ranking
@@ -201,45 +229,39 @@ class SearchReranker:
     
     def _remove_duplicates(self, results):
         """Remove duplicate results"""
-        seen_urls = {}
+        seen = set()
         unique_results = []
         
         for result in results:
-            url = result.get('url', '')
-            chunk_id = result.get('chunk_id', 0)
-            key = f"{url}_{chunk_id}"
+            key = (result.get('url', ''), result.get('chunk_id', 0))
             
-            if key not in seen_urls:
+            if key not in seen:
+                seen.add(key)
                 unique_results.append(result)
-                seen_urls[key] = True
                 
         return unique_results
     
     def _add_freshness_score(self, results):
         """Add freshness score based on recency"""
-        import datetime
-        now = datetime.datetime.now()
+        now = np.datetime64(datetime.now(), 'us')
+        times = visit_times(results)
         
-        for result in results:
-            freshness_score = 0.0
-            
-            if 'last_visit_time' in result and result['last_visit_time']:
-                try:
-                    visit_time = datetime.datetime.fromisoformat(result['last_visit_time'])
-                    age_days = (now - visit_time).days
-                    
-                    # Exponential decay based on age
-                    if age_days <= 1:
-                        freshness_score = 1.0  # Today
-                    elif age_days <= 7:
-                        freshness_score = 0.8  # This week
-                    elif age_days <= 30:
-                        freshness_score = 0.5  # This month
-                    else:
-                        freshness_score = max(0.1, 1.0 / (1.0 + (age_days / 30)))
-                except (ValueError, TypeError):
-                    pass
-                    
+        # A visit is at most N whole days old exactly when it is after now - (N + 1) days
+        age_days = age_in_days(now, times)
+        
+        # Exponential decay based on age; NaT compares False everywhere so unknown times score 0
+        freshness_scores = np.select(
+            [
+                times > now - np.timedelta64(2, 'D'),   # Today
+                times > now - np.timedelta64(8, 'D'),   # This week
+                times > now - np.timedelta64(31, 'D'),  # This month
+                ~np.isnat(times),
+            ],
+            [1.0, 0.8, 0.5, np.maximum(0.1, 1.0 / (1.0 + (age_days / 30)))],
+            default=0.0
+        )
+        
+        for result, freshness_score in zip(results, freshness_scores.tolist()):
             result['freshness_score'] = freshness_score
             
         return results
@@ -251,19 +273,25 @@ class SearchReranker:
             
         # Extract keywords from query
         keywords = self._extract_keywords(query)
+        if not keywords:
+            for result in results:
+                result['keyword_score'] = 0.0
+            return results
+            
+        # Each distinct keyword is searched for once, weighted by how often the query repeats it
+        keyword_counts = Counter(keywords).items()
+        total = len(keywords)
         
         for result in results:
             keyword_score = 0.0
             
-            if 'chunk_text' in result and result['chunk_text']:
-                text = result['chunk_text'].lower()
-                
-                # Count keyword matches
-                matches = sum(1 for keyword in keywords if keyword in text)
+            text = result.get('chunk_text')
+            if text:
+                text = text.lower()
                 
                 # Score based on percentage of keywords matched
-                if keywords:
-                    keyword_score = matches / len(keywords)
+                matches = sum(count for keyword, count in keyword_counts if keyword in text)
+                keyword_score = matches / total
                     
             result['keyword_score'] = keyword_score
             
@@ -271,23 +299,24 @@ class SearchReranker:
     
     def _basic_rank(self, results):
         """Basic ranking without a model"""
-        # Calculate combined score
-        for result in results:
-            keyword_score = result.get('keyword_score', 0.0)
-            freshness_score = result.get('freshness_score', 0.0)
+        # Equal weighting for keyword and freshness
+        return self._rank(results, BASIC_SCORE_WEIGHTS)
+    
+    def _rank(self, results, weights):
+        """Set final_score as a weighted sum of scores and sort by it, highest first"""
+        final_scores = np.zeros(len(results))
+        for key, weight, default in weights:
+            scores = np.fromiter((result.get(key, default) for result in results), dtype=np.float64, count=len(results))
+            final_scores += scores * weight
             
-            # Equal weighting for keyword and freshness
-            result['final_score'] = (keyword_score * 0.5) + (freshness_score * 0.5)
+        for result, final_score in zip(results, final_scores.tolist()):
+            result['final_score'] = final_score
             
-        # Sort by final score
-        return sorted(results, key=lambda x: x.get('final_score', 0.0), reverse=True)
+        # Stable, so equal scores keep their current order
+        return [results[i] for i in np.argsort(-final_scores, kind='stable')]
     
     def _extract_keywords(self, text):
         """Extract keywords from text"""
         # Simple stopword filtering
-        stopwords = {'a', 'an', 'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'with', 'about', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'}
-        
-        words = text.lower().split()
-        keywords = [w for w in words if w not in stopwords and len(w) > 2]
-        return keywords
+        return [w for w in text.lower().split() if w not in KEYWORD_STOPWORDS and len(w) > 2]
 
@@ -112,23 +112,178 @@
 """
 Enhanced retriever with hybrid search capabilities
 """
-import hashlib               
-
-import os
 import faiss
 import pickle
 import logging
 import json
 import numpy as np
-import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 
-from src.config import SEARCH_RESULTS_COUNT, BASE_DIR
-from src.database.models import HistoryModel
+from src.config import SEARCH_RESULTS_COUNT, BASE_DIR, HNSW_EF_SEARCH, USE_LANGCHAIN_SEARCH
+from src.database.models import HistoryModel, query_fingerprint
+from src.utils.time_utils import (
+    NAT, VISIT_MICROSECONDS_KEY, age_in_days, filter_visit_times, visit_microseconds, visit_times
+)
+from src.indexer.index_builder import (
+    IndexBuilder, METADATA_COLUMNS, METADATA_FILES,
+    PARQUET_METADATA_FILE, ZSTD_METADATA_FILE
+)
 
 logger = logging.getLogger(__name__)
 
+# Try to import numba - without it combined scores are computed with NumPy array operations
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    logger.warning("numba not available, ranking with NumPy. Install with 'pip install numba'")
+    NUMBA_AVAILABLE = False
+
+# Search-time parameter for IVF indexes; HNSW's efSearch comes from config
+IVF_NPROBE = 16
+
+# Most queued vector searches sent to FAISS in one batched call
+SEARCH_BATCH_SIZE = 32
+
+# Instruction sets FAISS reports when built with vectorized distance kernels
+FAISS_SIMD_OPTIONS = ('AVX2', 'AVX512', 'NEON', 'SVE')
+
+# Keyword searches run on these threads while the calling thread does the vector search
+KEYWORD_SEARCH_WORKERS = 4
+_keyword_pool = ThreadPoolExecutor(max_workers=KEYWORD_SEARCH_WORKERS, thread_name_prefix="keyword-search")
+
+# Recent search results kept in memory in front of the SQLite search cache, shared
+# by every HistoryRetriever
+SEARCH_CACHE_SIZE = 256
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+# Time filters that look back a fixed span from now
+RELATIVE_CUTOFFS = {
+    'this_week': timedelta(days=7),
+    'last_week': timedelta(days=14),
+    'this_month': timedelta(days=30),
+    'last_month': timedelta(days=60),
+    'recent': timedelta(days=14),
+}
+
+@lru_cache(maxsize=4096)
+def _query_hash(query_text):
+    """Memoized query_fingerprint, since the same queries are searched repeatedly"""
+    return query_fingerprint(query_text)
+
+@lru_cache(maxsize=None)
+def _langchain_embedder():
+    """The embedder to run LangChain searches with, loaded once per process, or None
+    when LangChain search is disabled or unavailable. Its vector store is reloaded
+    separately when an index job saves a new one"""
+    if not USE_LANGCHAIN_SEARCH:
+        return None
+        
+    from src.indexer.embedder import TextEmbedder
+    embedder = TextEmbedder()
+    return embedder if getattr(embedder, 'use_langchain', False) else None
+
+@lru_cache(maxsize=64)
+def _calendar_cutoff(today, time_type):
+    """Start of the calendar span a time filter covers; only changes when the date does"""
+    midnight = datetime(today.year, today.month, today.day)
+    if time_type == 'today':
+        return midnight
+    elif time_type == 'yesterday':
+        return midnight - timedelta(days=1)
+    elif time_type == 'this_year':
+        return datetime(today.year, 1, 1)
+    return None
+
+def _combined_scores(vector_scores, keyword_scores, age_days, undated):
+    """Fused ranking score per result, in one pass; matches the NumPy formula in
+    _rank_results exactly. NaN vector scores mark results without a vector hit"""
+    combined = np.empty_like(vector_scores)
+    for i in range(vector_scores.shape[0]):
+        similarity = 0.0 if np.isnan(vector_scores[i]) else 1.0 / (1.0 + vector_scores[i])
+        time_boost = 0.0 if undated[i] else max(0.0, 0.5 - (age_days[i] * 0.05))
+        combined[i] = (similarity * 0.6) + (keyword_scores[i] * 0.3) + time_boost
+    return combined
+
+if NUMBA_AVAILABLE:
+    # No fastmath, so scores and therefore tie order match the NumPy path
+    _combined_scores = njit(cache=True)(_combined_scores)
+
+class ColumnarMetadata:
+    """Parquet index metadata kept as an Arrow table, with rows built only for search hits.
+    
+    Loading creates no per-chunk dicts, so large histories load faster and take
+    far less memory than the row-wise pickle.
+    """
+    
+    def __init__(self, table):
+        self.table = table
+        
+    def __len__(self):
+        return self.table.num_rows
+        
+    def rows(self, indices):
+        """Metadata dicts for the given row positions, in order"""
+        if not indices:
+            return []
+        return self.table.take(indices).to_pylist()
+
+class SearchBatcher:
+    """Run concurrent vector searches against one index as batched index.search calls.
+    
+    The first caller to arrive searches for everyone queued behind it, so a lone
+    query adds no latency and no background thread is needed.
+    """
+    
+    def __init__(self, index, max_batch=SEARCH_BATCH_SIZE):
+        self.index = index
+        self.max_batch = max_batch
+        self._pending = []
+        self._lock = threading.Lock()
+        self._searching = False
+        
+    def search(self, query, top_k):
+        """Search for a (1, d) float32 query, returning (distances, indices) like index.search"""
+        future = Future()
+        with self._lock:
+            self._pending.append((query, top_k, future))
+            leader = not self._searching
+            self._searching = True
+            
+        if leader:
+            self._drain()
+        return future.result()
+        
+    def _drain(self):
+        """Search queued queries in batches until none are left"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._searching = False
+                    return
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._search_batch(batch)
+            
+    def _search_batch(self, batch):
+        try:
+            queries = np.vstack([query for query, _, _ in batch])
+            distances, indices = self.index.search(queries, max(top_k for _, top_k, _ in batch))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+            
+        # Each query gets its own row, cut to the number of results it asked for
+        for i, (_, top_k, future) in enumerate(batch):
+            future.set_result((distances[i:i + 1, :top_k], indices[i:i + 1, :top_k]))
+
 class HistoryRetriever:
     """Retrieve relevant history items using hybrid search"""
     
@@ -136,34 +291,117 @@ class HistoryRetriever:
         self.index_dir = Path(BASE_DIR) / "models"
         self.top_k = SEARCH_RESULTS_COUNT
         self.index = None
+        self.search_batcher = None
         self.metadata = None
+        self.metric = 'l2'
         self.history_model = HistoryModel()
         
+        # Index files and their modification times when loaded, to notice rebuilds
+        self.index_files = [self.index_dir / name for name in ["history_search.index", "index_info.json", *METADATA_FILES]]
+        self.index_mtimes = None
+        
         # Load the index and metadata
         self._load_index()
         
+    def _index_mtimes(self):
+        """Modification times of the index files, None for missing ones"""
+        return tuple(path.stat().st_mtime_ns if path.exists() else None for path in self.index_files)
+        
+    def is_stale(self):
+        """Whether the index on disk has been rebuilt since this retriever loaded it"""
+        return self._index_mtimes() != self.index_mtimes
+        
     def _load_index(self):
         """Load the index and metadata"""
+        # Taken before loading, so a rebuild that lands mid-load is picked up next time
+        self.index_mtimes = self._index_mtimes()
         index_path = self.index_dir / "history_search.index"
-        metadata_path = self.index_dir / "history_metadata.pkl"
+        info_path = self.index_dir / "index_info.json"
+        metadata_path = next(
+            (self.index_dir / name for name in METADATA_FILES if (self.index_dir / name).exists()),
+            None
+        )
         
-        if not index_path.exists() or not metadata_path.exists():
+        if not index_path.exists() or metadata_path is None:
             logger.warning("Index or metadata not found")
             return False
             
         try:
-            self.index = faiss.read_index(str(index_path))
-            
-            with open(metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
+            index_info = {}
+            if info_path.exists():
+                with open(info_path, 'r') as f:
+                    index_info = json.load(f)
+                    
+            # Indexes built before the switch to inner product have no metric
+            self.metric = index_info.get('metric', 'l2')
+            self.index = IndexBuilder.load_mmap(index_path, index_info.get('index_type'))
+            
+            # Widen the search beam for approximate indexes
+            if hasattr(self.index, 'hnsw'):
+                self.index.hnsw.efSearch = HNSW_EF_SEARCH
+            elif hasattr(self.index, 'nprobe'):
+                self.index.nprobe = IVF_NPROBE
+            self.search_batcher = SearchBatcher(self.index)
+            
+            if metadata_path.name == PARQUET_METADATA_FILE:
+                self.metadata = self._load_parquet_metadata(metadata_path)
+            elif metadata_path.name == ZSTD_METADATA_FILE:
+                import zstandard as zstd
+                with open(metadata_path, 'rb') as f:
+                    self.metadata = pickle.loads(zstd.ZstdDecompressor().decompress(f.read()))
+            else:
+                with open(metadata_path, 'rb') as f:
+                    self.metadata = pickle.load(f)
+                
+            # Indexes built before visit times were pre-parsed
+            if isinstance(self.metadata, list) and self.metadata and VISIT_MICROSECONDS_KEY not in self.metadata[0]:
+                for row in self.metadata:
+                    row[VISIT_MICROSECONDS_KEY] = visit_microseconds(row.get('last_visit_time'))
                 
             logger.info(f"Loaded index with {len(self.metadata)} items")
+            self._check_faiss_build()
             return True
             
         except Exception as e:
             logger.error(f"Error loading index: {e}")
             return False
     
+    def _check_faiss_build(self):
+        """Log which SIMD kernels FAISS was built with, warning when it has none"""
+        if not hasattr(faiss, 'get_compile_options'):
+            return
+            
+        compile_options = faiss.get_compile_options()
+        logger.info(f"FAISS compile options: {compile_options}")
+        if not any(option in compile_options for option in FAISS_SIMD_OPTIONS):
+            logger.warning(
+                "FAISS was built without AVX2/AVX-512 kernels, so searches use scalar distance code. "
+                "Install a SIMD-enabled build or compile with -DFAISS_OPT_LEVEL=avx2 (or avx512)"
+            )
+    
+    def _load_parquet_metadata(self, parquet_path):
+        """Load only the metadata columns used for search results"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        available = set(pq.read_schema(str(parquet_path)).names)
+        columns = [c for c in METADATA_COLUMNS if c in available]
+        table = pq.read_table(str(parquet_path), columns=columns)
+        
+        # Indexes built before visit times were pre-parsed
+        if VISIT_MICROSECONDS_KEY not in available:
+            micros = [visit_microseconds(t) for t in table.column('last_visit_time').to_pylist()] \
+                if 'last_visit_time' in available else [NAT] * table.num_rows
+            table = table.append_column(VISIT_MICROSECONDS_KEY, pa.array(micros, type=pa.int64()))
+            
+        return ColumnarMetadata(table)
+        
+    def _metadata_rows(self, indices):
+        """Copies of the metadata rows at the given positions"""
+        if isinstance(self.metadata, ColumnarMetadata):
+            return self.metadata.rows(indices)
+        return [dict(self.metadata[idx]) for idx in indices]
+    
     # def search(self, query_data, top_k=None):
     #     """Search for relevant history items using hybrid approach"""
     #     if self.index is None or self.metadata is None:
@@ -218,13 +456,25 @@ class HistoryRetriever:
             logger.info("Using cached search results")
             return cached_results
             
+        # An all-zero embedding (e.g. from an empty query) matches nothing meaningfully
+        embedding = query_data.get('embedding')
+        has_embedding = embedding is not None and bool(np.any(embedding))
+        if not has_embedding and not query_data['key_terms']:
+            logger.info("Nothing to search for in query")
+            return []
+            
+        # Start the keyword search first so its SQLite queries overlap the vector search
+        keyword_future = _keyword_pool.submit(self._keyword_search, query_data['key_terms'], top_k * 2)
+        
         # Try to use LangChain for better search
-        from src.indexer.embedder import TextEmbedder
-        embedder = TextEmbedder()
+        embedder = _langchain_embedder()
         
         langchain_results = []
-        if hasattr(embedder, 'use_langchain') and embedder.use_langchain:
+        if embedder is not None:
             try:
+                # The embedder outlives index jobs, so pick up any store they saved
+                embedder.reload_vector_store_if_changed()
+                
                 # Use LangChain search
                 langchain_results = embedder.search_langchain(
                     query_data['cleaned_query'], 
@@ -234,14 +484,17 @@ class HistoryRetriever:
             except Exception as e:
                 logger.error(f"LangChain search failed: {e}")
         
-        # 1. Vector search with semantic embedding (as fallback)
-        if not langchain_results:
-            vector_results = self._vector_search(query_data['embedding'], top_k * 2)
-        else:
+        # 1. Vector search with semantic embedding (as fallback), skipped when there
+        # is no index yet or nothing to embed
+        if langchain_results:
             vector_results = langchain_results
+        elif has_embedding and self.index is not None and self.index.ntotal > 0:
+            vector_results = self._vector_search(embedding, top_k * 2)
+        else:
+            vector_results = []
         
         # 2. Keyword search for better precision
-        keyword_results = self._keyword_search(query_data['key_terms'], top_k * 2)
+        keyword_results = keyword_future.result()
         
         # 3. Time-based filtering if needed
         if query_data['time_info']:
@@ -271,25 +524,29 @@ class HistoryRetriever:
         """Perform vector search with FAISS"""
         # Reshape query for FAISS
         query_embedding = np.array([query_embedding]).astype('float32')
+        if self.metric == 'ip':
+            faiss.normalize_L2(query_embedding)
         
-        # Perform search
-        distances, indices = self.index.search(query_embedding, top_k)
+        # Perform search, batched with any concurrent searches
+        distances, indices = self.search_batcher.search(query_embedding, top_k)
         
         # Collect results
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx == -1 or idx >= len(self.metadata):
-                continue
-                
-            # Get metadata for this result
-            metadata = self.metadata[idx].copy()
-            
+        num_items = len(self.metadata)
+        hits = [
+            (score, idx) for score, idx in zip(distances[0].tolist(), indices[0].tolist())
+            if idx != -1 and idx < num_items
+        ]
+        
+        # Copies of the metadata, so later scoring doesn't write into the shared metadata
+        results = self._metadata_rows([idx for _, idx in hits])
+        for (score, _), result in zip(hits, results):
             # Add distance score (lower is better for L2 distance)
-            score = float(distances[0][i])
-            metadata['score'] = score
-            metadata['search_type'] = 'vector'
-            
-            results.append(metadata)
+            if self.metric == 'ip':
+                # Squared L2 distance between unit vectors
+                score = max(0.0, 2.0 - 2.0 * score)
+                
+            result['score'] = score
+            result['search_type'] = 'vector'
             
         return results
         
@@ -299,11 +556,8 @@ class HistoryRetriever:
             return []
             
         try:
-            # Convert key terms to SQL LIKE patterns
-            patterns = [f"%{term}%" for term in key_terms]
-            
             # Use the database model to search
-            keyword_results = self.history_model.search_by_keywords(patterns, top_k)
+            keyword_results = self.history_model.search_by_keywords(key_terms, top_k)
             
             # Format results to match vector search format
             results = []
@@ -316,7 +570,7 @@ class HistoryRetriever:
                     'chunk_id': item['chunk_index'],
                     'chunk_text': item['chunk_text'],
                     'last_visit_time': item['last_visit_time'],
-                    'score': 1.0,  # Default score
+                    'score': item.get('score', 1.0),  # BM25-based for full-text matches
                     'search_type': 'keyword'
                 }
                 results.append(metadata)
@@ -329,7 +583,6 @@ class HistoryRetriever:
             
     def _filter_by_time(self, results, time_info):
         """Filter results by time with better date handling"""
-        filtered = []
         now = datetime.now()
         
         # Calculate cutoff date based on time_info
@@ -340,42 +593,11 @@ class HistoryRetriever:
             
         logger.info(f"Filtering by time: {time_info} - cutoff date: {cutoff_date}")
         
-        for result in results:
-            # Skip if no timestamp
-            if 'last_visit_time' not in result:
-                # If no timestamp but has time_info request, generally include it
-                # This helps when timestamps might be missing but content is relevant
-                filtered.append(result)
-                continue
-                
-            try:
-                # Try to parse timestamp - handle different formats
-                if isinstance(result['last_visit_time'], str):
-                    # Try ISO format first
-                    try:
-                        visit_time = datetime.fromisoformat(result['last_visit_time'])
-                    except ValueError:
-                        # Try other common formats
-                        for fmt in ['%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%m/%d/%Y %H:%M:%S']:
-                            try:
-                                visit_time = datetime.strptime(result['last_visit_time'], fmt)
-                                break
-                            except ValueError:
-                                continue
-                        else:
-                            # No format matched, use current time as fallback
-                            visit_time = now
-                else:
-                    # Not a string, use current time as fallback
-                    visit_time = now
-                    
-                # Check if after cutoff
-                if visit_time >= cutoff_date:
-                    filtered.append(result)
-            except Exception as e:
-                # On any error parsing, include the result anyway
-                logger.warning(f"Error parsing timestamp {result.get('last_visit_time')}: {e}")
-                filtered.append(result)
+        # Results with a missing or unparseable timestamp are generally included,
+        # since timestamps can be missing while the content is still relevant
+        times = filter_visit_times(results)
+        keep = np.isnat(times) | (times >= np.datetime64(cutoff_date, 'us'))
+        filtered = [result for result, kept in zip(results, keep.tolist()) if kept]
         
         # If filtering yields too few results, include some original results
         if len(filtered) < min(3, len(results) // 2):
@@ -393,140 +615,124 @@ class HistoryRetriever:
             
         time_type = time_info.get('type')
         
-        if time_type == 'today':
-            return datetime(now.year, now.month, now.day)
-        elif time_type == 'yesterday':
-            return datetime(now.year, now.month, now.day) - timedelta(days=1)
-        elif time_type == 'this_week':
-            return now - timedelta(days=7)
-        elif time_type == 'last_week':
-            return now - timedelta(days=14)
-        elif time_type == 'this_month':
-            return now - timedelta(days=30)
-        elif time_type == 'last_month':
-            return now - timedelta(days=60)
-        elif time_type == 'this_year':
-            return datetime(now.year, 1, 1)
-        elif time_type == 'recent':
-            return now - timedelta(days=14)
+        if time_type in RELATIVE_CUTOFFS:
+            return now - RELATIVE_CUTOFFS[time_type]
         elif time_type == 'days_ago':
             days = time_info.get('value', 7)
             return now - timedelta(days=days)
             
-        return None
+        return _calendar_cutoff(now.date(), time_type)
         
     def _merge_results(self, vector_results, keyword_results, query_data):
         """Merge vector and keyword search results"""
-        # Create a dictionary to track seen URLs to avoid duplicates
-        seen_urls = {}
+        # Merged results by (url, chunk_id), in the order they were first found
+        merged = {}
         
         # Process vector results first
-        merged = []
         for result in vector_results:
-            url = result.get('url', '')
-            chunk_id = result.get('chunk_id', 0)
-            key = f"{url}_{chunk_id}"
+            key = (result.get('url', ''), result.get('chunk_id', 0))
             
-            if key not in seen_urls:
+            if key not in merged:
                 # Add vector score
                 result['vector_score'] = result.get('score', 1.0)
                 # Add placeholder keyword score
                 result['keyword_score'] = 0.0
-                # Add to merged results
-                merged.append(result)
-                seen_urls[key] = len(merged) - 1
+                merged[key] = result
                 
         # Process keyword results
         for result in keyword_results:
-            url = result.get('url', '')
-            chunk_id = result.get('chunk_id', 0)
-            key = f"{url}_{chunk_id}"
+            key = (result.get('url', ''), result.get('chunk_id', 0))
             
-            if key in seen_urls:
+            existing = merged.get(key)
+            if existing is not None:
                 # Update existing entry with keyword score
-                idx = seen_urls[key]
-                merged[idx]['keyword_score'] = result.get('score', 1.0)
+                existing['keyword_score'] = result.get('score', 1.0)
                 # Update if this was found by both searches
-                merged[idx]['search_type'] = 'hybrid'
+                existing['search_type'] = 'hybrid'
             else:
-                # Add vector score placeholder
-                result['vector_score'] = 0.0
+                # No vector hit; None rather than 0.0, which is an exact match
+                result['vector_score'] = None
                 # Add keyword score
                 result['keyword_score'] = result.get('score', 1.0)
-                # Add to merged results
-                merged.append(result)
-                seen_urls[key] = len(merged) - 1
+                merged[key] = result
                 
-        return merged
+        return list(merged.values())
         
     def _rank_results(self, results, query_data):
         """Apply final ranking to results"""
         if not results:
             return []
             
-        # Calculate combined scores
-        for result in results:
-            # Normalize vector score (lower is better for L2 distance)
-            vector_score = result.get('vector_score', 0.0)
-            if vector_score > 0:  # If there is a vector score
-                # Convert to similarity score (higher is better)
-                vector_similarity = 1.0 / (1.0 + vector_score)
-            else:
-                vector_similarity = 0.0
-                
-            # Keyword score is already higher is better
-            keyword_score = result.get('keyword_score', 0.0)
-            
-            # Time boost - more recent is better
-            time_boost = 0.0
-            if 'last_visit_time' in result:
-                try:
-                    visit_time = datetime.fromisoformat(result['last_visit_time'])
-                    days_ago = (datetime.now() - visit_time).days
-                    # Boost for recency (max 0.5 for today)
-                    time_boost = max(0.0, 0.5 - (days_ago * 0.05))
-                except (ValueError, TypeError):
-                    pass
-                    
-            # Domain boost - certain domains might be more relevant
-            domain_boost = 0.0
+        # Distances, with NaN for results that had no vector hit
+        vector_scores = np.fromiter(
+            (np.nan if result.get('vector_score') is None else result['vector_score'] for result in results),
+            dtype=np.float64, count=len(results)
+        )
+        keyword_scores = np.fromiter((result.get('keyword_score', 0.0) for result in results), dtype=np.float64, count=len(results))
+        now = np.datetime64(datetime.now(), 'us')
+        times = visit_times(results)
+        
+        if NUMBA_AVAILABLE:
+            combined_scores = _combined_scores(vector_scores, keyword_scores, age_in_days(now, times), np.isnat(times))
+        else:
+            # Normalize vector score (lower is better for L2 distance) to a similarity
+            # (higher is better); results without a vector hit get 0
+            vector_similarity = np.divide(1.0, 1.0 + vector_scores, out=np.zeros(len(results)), where=~np.isnan(vector_scores))
             
-            # Calculate combined score
-            # Weight vector similarity higher (0.6) than keyword (0.3)
-            combined_score = (
-                (vector_similarity * 0.6) + 
-                (keyword_score * 0.3) + 
-                time_boost + 
-                domain_boost
-            )
+            # Time boost - more recent is better (max 0.5 for today)
+            time_boost = np.where(np.isnat(times), 0.0, np.maximum(0.0, 0.5 - (age_in_days(now, times) * 0.05)))
             
+            # Calculate combined score
+            # Weight vector similarity higher (0.6) than keyword (0.3); keyword score is already higher is better
+            combined_scores = (vector_similarity * 0.6) + (keyword_scores * 0.3) + time_boost
+        
+        for result, combined_score in zip(results, combined_scores.tolist()):
             result['combined_score'] = combined_score
             
-        # Sort by combined score
-        return sorted(results, key=lambda x: x.get('combined_score', 0.0), reverse=True)
+        # Sort by combined score, keeping ties in their current order
+        return [results[i] for i in np.argsort(-combined_scores, kind='stable')]
         
     def _get_query_hash(self, query_text):
         """Generate a hash for the query"""
-        return hashlib.md5(query_text.encode()).hexdigest()
+        return _query_hash(query_text)
         
     def _get_cached_results(self, query_hash):
-        """Get cached search results"""
-        # This would be implemented in the database model
-        cached_results = self.history_model.get_search_cache(query_hash)
-        if cached_results:
+        """Get cached search results, from memory when possible"""
+        with _search_cache_lock:
+            cached_results = _search_cache.get(query_hash)
+            if cached_results is not None:
+                _search_cache.move_to_end(query_hash)
+                
+        if cached_results is None:
+            # This would be implemented in the database model
+            cached_json = self.history_model.get_search_cache(query_hash)
+            if not cached_json:
+                return None
             try:
-                return json.loads(cached_results)
+                cached_results = json.loads(cached_json)
             except:
                 return None
-        return None
+            self._remember_results(query_hash, cached_results)
+            
+        # Copy so callers can't mutate the cached results
+        return [dict(result) for result in cached_results]
         
     def _cache_results(self, query_hash, results):
         """Cache search results"""
+        self._remember_results(query_hash, [dict(result) for result in results])
+        
         # This would be implemented in the database model
         try:
             self.history_model.cache_search_results(query_hash, json.dumps(results))
         except Exception as e:
             logger.error(f"Error caching search results: {e}")
+            
+    def _remember_results(self, query_hash, results):
+        """Add search results to the in-memory cache, evicting the least recently used"""
+        with _search_cache_lock:
+            _search_cache[query_hash] = results
+            if len(_search_cache) > SEARCH_CACHE_SIZE:
+                _search_cache.popitem(last=False)
     
     def filter_by_domain(self, results, domains=None):
         """Filter results by domain"""
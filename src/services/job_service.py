@@ -0,0 +1,54 @@
+"""
+Background jobs shared by the API routes and the scheduler
+"""
+import logging
+
+from src.indexer.history_extractor import HistoryExtractor
+from src.indexer.scraper import WebScraper
+from src.indexer.content_processor import ContentProcessor
+from src.indexer.embedder import TextEmbedder
+from src.indexer.index_builder import IndexBuilder
+
+logger = logging.getLogger(__name__)
+
+def extract_job():
+    """Extract browsing history and update database"""
+    extractor = HistoryExtractor()
+    inserted_count = extractor.extract_history()
+    return f'Extracted {inserted_count} history entries'
+
+def scrape_job(limit=50):
+    """Scrape pages from history"""
+    scraper = WebScraper()
+    scraped_count = scraper.scrape_unprocessed_pages(limit)
+    return f'Scraped {scraped_count} pages'
+
+def index_job():
+    """Build search index from scraped content"""
+    # Process content
+    processor = ContentProcessor()
+    processed_items = processor.process_batch()
+
+    if not processed_items:
+        return 'No new content to index'
+
+    # Embed the items
+    embedder = TextEmbedder()
+    # Get the embedding dimension
+    embedding_dim = embedder.get_embedding_dimension()
+    logger.info(f"Using embedding dimension: {embedding_dim}")
+
+    embedded_items = embedder.embed_batch(processed_items)
+
+    # Build the index
+    index_builder = IndexBuilder(embedding_dim=embedding_dim)
+    index_builder.build_index(embedded_items)
+
+    return f'Indexed {len(processed_items)} pages'
+
+# Jobs the scheduler runs, by name
+JOBS = {
+    'extract': extract_job,
+    'scrape': scrape_job,
+    'index': index_job,
+}
@@ -1,30 +1,30 @@
 """
 Scheduler service for background jobs
 """
+import heapq
 import threading
 import time
 import logging
-import requests
 from datetime import datetime
 
-from src.config import (
-    EXTRACT_INTERVAL, SCRAPE_INTERVAL, INDEX_INTERVAL,
-    APP_HOST, APP_PORT
-)
+from src.config import EXTRACT_INTERVAL, SCRAPE_INTERVAL, INDEX_INTERVAL
+from src.services.job_service import JOBS
 
 logger = logging.getLogger(__name__)
 
 class SchedulerService:
     """Scheduler for running background jobs"""
     
-    def __init__(self):
-        self.base_url = f"http://{APP_HOST}:{APP_PORT}/api"
+    def __init__(self, jobs=None):
+        # Job functions are called directly in the scheduler thread rather than
+        # through the app's HTTP endpoints
+        self.jobs = jobs if jobs is not None else JOBS
         self.extract_interval = EXTRACT_INTERVAL  # minutes
         self.scrape_interval = SCRAPE_INTERVAL    # minutes
         self.index_interval = INDEX_INTERVAL      # minutes
         self.running = False
         self.thread = None
-        self.startup_delay = 10  # seconds to wait before starting scheduler
+        self.stop_event = threading.Event()  # Set to wake the scheduler thread and stop it
         
     def start(self):
         """Start the scheduler"""
@@ -33,88 +33,55 @@ class SchedulerService:
             return
             
         self.running = True
+        self.stop_event.clear()
         self.thread = threading.Thread(target=self._run)
         self.thread.daemon = True
         self.thread.start()
         
-        logger.info(f"Scheduler started (will begin running jobs after {self.startup_delay} seconds)")
+        logger.info("Scheduler started")
         
     def stop(self):
         """Stop the scheduler"""
         self.running = False
+        self.stop_event.set()
         logger.info("Scheduler stopped")
         
     def _run(self):
         """Run the scheduler loop"""
-        # Initial delay to allow Flask app to start
-        logger.info(f"Waiting {self.startup_delay} seconds for Flask app to start...")
-        time.sleep(self.startup_delay)
-        
-        # Wait until server is actually reachable
-        self._wait_for_server()
-        
-        last_extract = 0
-        last_scrape = 0
-        last_index = 0
+        intervals = {
+            'extract': self.extract_interval * 60,
+            'scrape': self.scrape_interval * 60,
+            'index': self.index_interval * 60,
+        }
         
         # Run extract job immediately on startup
         self._run_job('extract')
-        last_extract = time.time()
+        now = time.time()
+        
+        # Heap of (due time, order, job); order runs jobs due together as extract, scrape, index
+        schedule = [
+            (now + intervals['extract'], 0, 'extract'),
+            (now, 1, 'scrape'),
+            (now, 2, 'index'),
+        ]
+        heapq.heapify(schedule)
         
         while self.running:
-            now = time.time()
+            due, order, job_type = schedule[0]
             
-            # Check if it's time to extract history
-            if now - last_extract > self.extract_interval * 60:
-                self._run_job('extract')
-                last_extract = now
-                
-            # Check if it's time to scrape pages
-            if now - last_scrape > self.scrape_interval * 60:
-                self._run_job('scrape')
-                last_scrape = now
+            # Sleep until the next job is due, waking immediately if stopped
+            if self.stop_event.wait(max(0, due - time.time())):
+                break
                 
-            # Check if it's time to build index
-            if now - last_index > self.index_interval * 60:
-                self._run_job('index')
-                last_index = now
-                
-            # Sleep to avoid high CPU usage
-            time.sleep(60)
+            heapq.heapreplace(schedule, (time.time() + intervals[job_type], order, job_type))
+            self._run_job(job_type)
             
-    def _wait_for_server(self):
-        """Wait until the Flask server is reachable"""
-        max_attempts = 30
-        for attempt in range(max_attempts):
-            try:
-                # Try a simple request to check if server is up
-                requests.get(f"http://{APP_HOST}:{APP_PORT}/", timeout=1)
-                logger.info("Flask server is now reachable")
-                return True
-            except requests.RequestException:
-                if attempt < max_attempts - 1:
-                    logger.info(f"Waiting for Flask server to start... ({attempt+1}/{max_attempts})")
-                    time.sleep(2)
-                else:
-                    logger.warning("Flask server not reachable after maximum attempts")
-                    return False
-    
     def _run_job(self, job_type):
-        """Run a job by making an API request"""
+        """Run a job in the scheduler thread"""
         try:
             logger.info(f"Running job: {job_type}")
+            message = self.jobs[job_type]()
+            logger.info(f"Job completed successfully: {job_type} - {message}")
             
-            url = f"{self.base_url}/{job_type}"
-            response = requests.post(url, json={}, timeout=30)  # Increased timeout
-            
-            if response.status_code == 200:
-                logger.info(f"Job completed successfully: {job_type}")
-            else:
-                logger.error(f"Job failed: {job_type} - Status: {response.status_code}, Response: {response.text[:100]}")
-                
-        except requests.exceptions.Timeout:
-            logger.error(f"Timeout running job {job_type} - server may be busy")
-        except requests.exceptions.ConnectionError:
-            logger.error(f"Connection error running job {job_type} - server may not be running")
         except Exception as e:
-            logger.error(f"Error running job {job_type}: {e}")
\ No newline at end of file
+            logger.error(f"Error running job {job_type}: {e}")
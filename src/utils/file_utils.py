@@ -1 +1,73 @@
-# file_utils.py
\ No newline at end of file
+# file_utils.py
+"""
+Append-only shard files for storing many small scraped pages
+"""
+import os
+import mmap
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Number of shard files pages are spread across
+NUM_SHARDS = 64
+
+# Each record is a 4-byte little-endian length followed by the data
+LENGTH_PREFIX_BYTES = 4
+
+# Location of one record: data starts at offset and is length bytes long
+ShardRecord = namedtuple('ShardRecord', ['path', 'shard_id', 'offset', 'length'])
+
+def _fnv1a(key):
+    """32-bit FNV-1a hash of a string"""
+    h = 0x811c9dc5
+    for byte in key.encode('utf-8'):
+        h = ((h ^ byte) * 0x01000193) & 0xffffffff
+    return h
+
+class ShardWriter:
+    """Append records to a fixed set of shard files chosen by key hash"""
+
+    def __init__(self, shard_dir, num_shards=NUM_SHARDS):
+        self.shard_dir = shard_dir
+        self.num_shards = num_shards
+        self.files = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+    def shard_path(self, shard_id):
+        return os.path.join(self.shard_dir, f"shard_{shard_id:02x}.bin")
+
+    def append(self, key, data):
+        """Append data to the shard for key and return its ShardRecord"""
+        shard_id = _fnv1a(key) % self.num_shards
+        path = self.shard_path(shard_id)
+
+        with self.lock:
+            f = self.files.get(shard_id)
+            if f is None:
+                f = open(path, 'ab')
+                self.files[shard_id] = f
+            offset = f.tell() + LENGTH_PREFIX_BYTES
+            f.write(len(data).to_bytes(LENGTH_PREFIX_BYTES, 'little') + data)
+
+        return ShardRecord(path, shard_id, offset, len(data))
+
+    def flush(self):
+        """Flush buffered records so readers can see them"""
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+def read_shard_record(path, offset, length):
+    """Read one record from a shard file"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[offset:offset + length]
@@ -1 +1,7 @@
-# text_utils.py
\ No newline at end of file
+# text_utils.py
+"""
+Text helpers shared by the searcher and LLM modules
+"""
+
+# Words ignored when extracting keywords from queries and chunks
+KEYWORD_STOPWORDS = frozenset({'a', 'an', 'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'with', 'about', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'})
@@ -0,0 +1,91 @@
+# time_utils.py
+"""
+Vectorized handling of history visit times
+"""
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+# Visit times are handled as integer microseconds since the epoch, the layout of datetime64[us]
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+NAT = np.iinfo(np.int64).min  # datetime64's NaT
+
+# Metadata key holding last_visit_time pre-parsed to microseconds at index-build time
+VISIT_MICROSECONDS_KEY = 'last_visit_us'
+
+# Non-ISO layouts the time filter also accepts for visit times, each with a prefix
+# that tells them apart so only the one format that can match is tried
+VISIT_TIME_FORMATS = [
+    ('%Y/%m/%d %H:%M:%S', re.compile(r'\d{4}/')),
+    ('%m/%d/%Y %H:%M:%S', re.compile(r'\d{1,2}/')),
+]
+
+@lru_cache(maxsize=8192)
+def _iso_microseconds(timestamp):
+    """Microseconds since the epoch of a naive ISO timestamp, or NAT if unusable; memoized
+    since many results share a visit time"""
+    try:
+        visit_time = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        return NAT
+    # Timezone-aware times can't be compared with the local naive clock
+    if visit_time.tzinfo is not None:
+        return NAT
+    return (visit_time - EPOCH) // ONE_MICROSECOND
+
+def visit_microseconds(timestamp):
+    """Microseconds since the epoch of a visit time, or NAT if missing or unparseable"""
+    if not timestamp:
+        return NAT
+    try:
+        return _iso_microseconds(timestamp)
+    except TypeError:  # Unhashable, so not a timestamp string
+        return NAT
+
+@lru_cache(maxsize=8192)
+def _lenient_microseconds(timestamp):
+    """Like _iso_microseconds, but also trying VISIT_TIME_FORMATS"""
+    micros = _iso_microseconds(timestamp)
+    if micros != NAT:
+        return micros
+    fmt = next((fmt for fmt, prefix in VISIT_TIME_FORMATS if prefix.match(timestamp)), None)
+    if fmt is None:
+        return NAT
+    try:
+        return (datetime.strptime(timestamp, fmt) - EPOCH) // ONE_MICROSECOND
+    except ValueError:
+        return NAT
+
+def _result_microseconds(result):
+    """A result's visit time in microseconds, using the index-time value when present"""
+    micros = result.get(VISIT_MICROSECONDS_KEY)
+    if micros is None:
+        return visit_microseconds(result.get('last_visit_time'))
+    return micros
+
+def visit_times(results):
+    """datetime64[us] array of the results' last_visit_time, NaT where unknown"""
+    return np.fromiter(
+        (_result_microseconds(result) for result in results),
+        dtype=np.int64, count=len(results)
+    ).view('datetime64[us]')
+
+def filter_visit_times(results):
+    """Like visit_times, but also accepting VISIT_TIME_FORMATS"""
+    def micros(result):
+        timestamp = result.get('last_visit_time')
+        if not isinstance(timestamp, str):
+            return NAT
+        parsed = result.get(VISIT_MICROSECONDS_KEY, NAT)
+        return parsed if parsed != NAT else _lenient_microseconds(timestamp)
+        
+    return np.fromiter(
+        (micros(result) for result in results), dtype=np.int64, count=len(results)
+    ).view('datetime64[us]')
+
+def age_in_days(now, times):
+    """Whole days between each time and now (like timedelta.days), 0 where the time is NaT"""
+    return (now - np.where(np.isnat(times), now, times)) // np.timedelta64(1, 'D')